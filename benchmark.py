@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from calculations import calculate_landed_cost, calculate_pricing, calculate_rrpp, calculate_tiered_pricing
+from database_setup import get_initial_category_multipliers, get_initial_markup_data
+from ingestion import clean_purchase_frame, compact_purchase_frame, read_purchase_frame
+from instrumentation import write_metrics
+from storage import connect, save_priced_parts
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+BASELINE_PATH = "benchmark_baseline.json"
+DEFAULT_TOLERANCE_PCT = 25.0
+# Slowdowns smaller than this are timer noise on the 1k-row runs, whatever the percentage
+MIN_REGRESSION_SECONDS = 0.005
+
+BENCH_CURRENCY = "USD"
+BENCH_EXCHANGE_RATE = 0.65
+BENCH_FREIGHT_COST = 1200.0
+
+def generate_invoice(rows, seed=0, exchange_rate=BENCH_EXCHANGE_RATE):
+    # Landed costs cover every markup band, weighted towards the cheaper bands as real
+    # invoices are, and every category from the initial multiplier table appears
+    rng = np.random.default_rng(seed)
+    markup = get_initial_markup_data()
+    categories = get_initial_category_multipliers()["Category"].to_numpy()
+    weights = 1 / np.sqrt(np.arange(1, len(markup) + 1))
+    bands = rng.choice(len(markup), size=rows, p=weights / weights.sum())
+    landed = rng.uniform(markup["From"].to_numpy()[bands], markup["To"].to_numpy()[bands])
+    qty = rng.geometric(0.15, size=rows)
+    qty[rng.random(rows) < 0.01] = 0
+    return pd.DataFrame({
+        "Qty": qty,
+        "Inv #": np.char.add("INV", (np.arange(rows) // 500).astype(str)),
+        "Part Number": np.char.add("PN", np.char.zfill(rng.integers(0, max(rows, 10), rows).astype(str), 7)),
+        "Purchase Cost": np.round(landed * exchange_rate, 2),
+        "Category": rng.choice(categories, size=rows),
+    })
+
+def _pricing_inputs(df):
+    category_multipliers_df = get_initial_category_multipliers()
+    category_multipliers = dict(zip(category_multipliers_df.Category, category_multipliers_df.Multiplier))
+    priced = df.copy()
+    priced["Qty"] = priced["Qty"].astype(float)
+    total_purchase = (priced["Qty"] * priced["Purchase Cost"]).sum()
+    return priced, total_purchase, get_initial_markup_data(), category_multipliers
+
+def build_stages(df, workdir):
+    # Each stage is (name, setup, run); setup output is passed to run and is not timed
+    base, total_purchase, markup, category_multipliers = _pricing_inputs(df)
+    csv_path = os.path.join(workdir, "invoice.csv")
+    df.to_csv(csv_path, index=False)
+    landed = calculate_landed_cost(base.copy(), total_purchase, BENCH_FREIGHT_COST, BENCH_CURRENCY, BENCH_EXCHANGE_RATE)
+    with_rrpp = calculate_rrpp(landed.copy(), markup, category_multipliers)
+    priced = calculate_pricing(base.copy(), total_purchase, BENCH_FREIGHT_COST, BENCH_CURRENCY, BENCH_EXCHANGE_RATE, markup, category_multipliers)
+    compact = compact_purchase_frame(df.copy(), list(category_multipliers))
+
+    def fresh_db():
+        path = os.path.join(workdir, f"bench_{time.perf_counter_ns()}.db")
+        return connect(path)
+
+    return [
+        ("ingest_csv", lambda: None, lambda _: clean_purchase_frame(read_purchase_frame(csv_path, csv_path))),
+        ("landed_cost", base.copy, lambda d: calculate_landed_cost(d, total_purchase, BENCH_FREIGHT_COST, BENCH_CURRENCY, BENCH_EXCHANGE_RATE)),
+        ("rrpp", landed.copy, lambda d: calculate_rrpp(d, markup, category_multipliers)),
+        ("tiers", with_rrpp.copy, calculate_tiered_pricing),
+        ("calculate_pricing", base.copy, lambda d: calculate_pricing(d, total_purchase, BENCH_FREIGHT_COST, BENCH_CURRENCY, BENCH_EXCHANGE_RATE, markup, category_multipliers)),
+        ("calculate_pricing_compact", compact.copy, lambda d: calculate_pricing(d, total_purchase, BENCH_FREIGHT_COST, BENCH_CURRENCY, BENCH_EXCHANGE_RATE, markup, category_multipliers, compact=True)),
+        ("save_sqlite", fresh_db, lambda conn: (save_priced_parts(conn, priced), conn.close())),
+    ]
+
+def _measure(setup, run, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+    # Peak memory is measured in a separate run so tracemalloc overhead stays out of the timings
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, stages=None, seed=0, log=print):
+    results = {}
+    for rows in sizes:
+        df = generate_invoice(rows, seed)
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, setup, run in build_stages(df, workdir):
+                if stages and name not in stages:
+                    continue
+                seconds, peak = _measure(setup, run, 1 if rows >= 1_000_000 else repeat)
+                key = f"{name}@{rows}"
+                results[key] = {"stage": name, "rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else None, "alloc_mb": peak / 2**20}
+                log(f"{name:<26} {rows:>9} rows  {seconds * 1000:>10.1f} ms  {rows / seconds if seconds else float('inf'):>14,.0f} rows/s  {peak / 2**20:>8.1f} MB peak")
+    return results
+
+def compare_to_baseline(results, baseline, tolerance_pct=DEFAULT_TOLERANCE_PCT):
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous or result["seconds"] - previous["seconds"] < MIN_REGRESSION_SECONDS:
+            continue
+        if result["seconds"] > previous["seconds"] * (1 + tolerance_pct / 100):
+            regressions.append((key, previous["seconds"], result["seconds"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pricing engine hot paths on synthetic invoices.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Invoice sizes in rows.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (best is kept).")
+    parser.add_argument("--stages", nargs="+", default=None, help="Only run these stages.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to save to or compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if any stage is slower than the baseline.")
+    parser.add_argument("--metrics", default=None, help="Append the results to this JSON Lines metrics file.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE_PCT, help="Allowed slowdown in percent.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.stages)
+    if args.metrics:
+        write_metrics(args.metrics, [{"source": "benchmark", **result} for result in results.values()])
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first.", file=sys.stderr)
+            return 1
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for key, before, after in regressions:
+            print(f"REGRESSION {key}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No stage slower than baseline by more than {args.tolerance}%.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
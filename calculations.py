@@ -1,32 +1,223 @@
-
+import numpy as np
 import pandas as pd
+from freight import DEFAULT_FREIGHT, freight_inputs
+from instrumentation import measure
+from markup_index import get_markup_index
+
+TIER1_REDUCED_DISCOUNT_CATEGORIES = ['Speciality Fast', 'Universal', 'Local']
+
+PRICED_COLUMNS = [
+    'Purchase Cost AUD', 'Landed Cost AUD', 'RRPP Markup', 'Category Multiplier', 'RRPP',
+    'Tier 1', 'Tier 2', 'Tier 3', 'Tier 4', 'Tier 5',
+]
+
+# The working frame in the app keeps the markup band code instead of the RRPP Markup and
+# Category Multiplier floats; expand_priced_frame restores them when the frame is saved
+COMPACT_PRICED_COLUMNS = [
+    'Purchase Cost AUD', 'Landed Cost AUD', 'Markup Band', 'RRPP',
+    'Tier 1', 'Tier 2', 'Tier 3', 'Tier 4', 'Tier 5',
+]
 
-def calculate_landed_cost(df, total_purchase, freight_cost, currency, exchange_rate):
-    df['Purchase Cost AUD'] = df['Purchase Cost'] / exchange_rate if currency != "AUD" else df['Purchase Cost']
-    if total_purchase > 0:
-        df['Landed Cost AUD'] = df.apply(
-            lambda row: row['Purchase Cost AUD'] + (((row['Qty'] * row['Purchase Cost']) / total_purchase) * freight_cost) / row['Qty']
-            if row['Qty'] > 0 else row['Purchase Cost AUD'],
-            axis=1
+# (discount on previous tier, RRPP multiplier cap, margin threshold) for tiers 2-5
+TIER_STEPS = [
+    (0.95, 1.37, 0.37),
+    (0.9, 1.35, 0.35),
+    (0.85, 1.3, 0.3),
+    (0.95, 1.25, 0.25),
+]
+
+def check_exchange_rate(currency, exchange_rate):
+    # A zero or missing rate would turn every price into inf or NaN
+    if currency != "AUD" and not exchange_rate > 0:
+        raise ValueError(f"Exchange rate must be greater than 0, got {exchange_rate}")
+
+def landed_cost_arrays(qty, purchase_cost, total_purchase, freight_cost, currency, exchange_rate, freight=None, freight_columns=None):
+    # freight is the allocation strategy (freight.py), value-proportional by default;
+    # freight_columns holds the extra input columns it reads
+    check_exchange_rate(currency, exchange_rate)
+    qty = np.asarray(qty, dtype=float)
+    purchase_cost = np.asarray(purchase_cost, dtype=float)
+    purchase_cost_aud = purchase_cost / exchange_rate if currency != "AUD" else purchase_cost
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freight_per_unit = (freight or DEFAULT_FREIGHT).freight_per_unit(
+            qty, purchase_cost, purchase_cost_aud, freight_columns or {}, total_purchase, freight_cost,
         )
+    if freight_per_unit is not None:
+        landed_cost_aud = np.where(qty > 0, purchase_cost_aud + freight_per_unit, purchase_cost_aud)
     else:
-        df['Landed Cost AUD'] = df['Purchase Cost AUD']
+        landed_cost_aud = purchase_cost_aud
+    return purchase_cost_aud, landed_cost_aud
+
+def lookup_rrpp_markup_array(costs, edited_markup, on_gap="lower"):
+    return get_markup_index(edited_markup, on_gap).lookup(costs)
+
+def rrpp_array(landed_cost_aud, rrpp_markup, category_multiplier):
+    return np.round(landed_cost_aud * ((rrpp_markup * category_multiplier) + 1), 0)
+
+def tier_arrays(rrpp, reduced_discount):
+    # Rounded tiers as floats, NaN wherever RRPP is missing or infinite; tier_column makes
+    # the integer column
+    rrpp = np.asarray(rrpp, dtype=float)
+    # np.rint rounds half to even, matching Python's round() on floats
+    tiers = [np.rint(np.where(reduced_discount, rrpp * 0.95, rrpp * 0.9))]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for discount, cap, threshold in TIER_STEPS:
+            previous = tiers[-1]
+            tiers.append(np.where(
+                ((-rrpp + (previous * discount)) / rrpp) > threshold,
+                np.rint(rrpp * cap),
+                np.rint(previous * discount),
+            ))
+    return [np.where(np.isfinite(tier), tier, np.nan) for tier in tiers]
+
+def tier_column(tier):
+    # Nullable integers: a row without a price keeps a missing tier instead of a cast NaN
+    missing = ~np.isfinite(tier)
+    return pd.arrays.IntegerArray(np.where(missing, 0, tier).astype(np.int64), missing)
+
+def category_multiplier_array(categories, category_multipliers):
+    categories = pd.Series(categories)
+    if isinstance(categories.dtype, pd.CategoricalDtype):
+        # Map each distinct category once and gather by code
+        by_code = np.array([category_multipliers.get(c, np.nan) for c in categories.cat.categories], dtype=float)
+        codes = categories.cat.codes.to_numpy()
+        multiplier = np.where(codes >= 0, by_code[np.maximum(codes, 0)] if len(by_code) else np.nan, np.nan)
+        return np.where(np.isnan(multiplier), 1.0, multiplier)
+    return categories.map(category_multipliers).fillna(1.0).to_numpy(dtype=float)
+
+def _compact(columns, band_codes, code_dtype):
+    # Swap the per-row markup and multiplier floats for the band code and narrow the tiers
+    del columns['RRPP Markup'], columns['Category Multiplier']
+    columns['Markup Band'] = np.asarray(band_codes).astype(code_dtype)
+    for i in range(1, 6):
+        columns[f'Tier {i}'] = columns[f'Tier {i}'].astype("Int32")
+    return {name: columns[name] for name in COMPACT_PRICED_COLUMNS if name in columns}
+
+def price_arrays(qty, purchase_cost, categories, total_purchase, freight_cost, currency, exchange_rate, edited_markup, category_multipliers, on_gap="lower", metrics=None, compact=False, freight=None, freight_columns=None):
+    rows = len(qty)
+    with measure(metrics, 'landed_cost', rows):
+        purchase_cost_aud, landed_cost_aud = landed_cost_arrays(qty, purchase_cost, total_purchase, freight_cost, currency, exchange_rate, freight, freight_columns)
+    with measure(metrics, 'markup_lookup', rows):
+        markup_index = get_markup_index(edited_markup, on_gap)
+        band_codes = markup_index.resolved_codes(landed_cost_aud)
+        rrpp_markup = markup_index.markups_for(band_codes)
+    columns = {
+        'Purchase Cost AUD': purchase_cost_aud,
+        'Landed Cost AUD': landed_cost_aud,
+    }
+    with measure(metrics, 'rrpp_and_tiers', rows):
+        columns.update(category_price_arrays(landed_cost_aud, rrpp_markup, categories, category_multipliers))
+    if compact:
+        columns = _compact(columns, band_codes, markup_index.code_dtype())
+    return columns
+
+def category_price_arrays(landed_cost_aud, rrpp_markup, categories, category_multipliers):
+    # Everything downstream of the markup lookup; the only pricing step that depends on Category
+    categories = pd.Series(categories)
+    category_multiplier = category_multiplier_array(categories, category_multipliers)
+    rrpp = rrpp_array(np.asarray(landed_cost_aud, dtype=float), np.asarray(rrpp_markup, dtype=float), category_multiplier)
+    tiers = tier_arrays(rrpp, categories.isin(TIER1_REDUCED_DISCOUNT_CATEGORIES).to_numpy())
+    columns = {
+        'RRPP Markup': rrpp_markup,
+        'Category Multiplier': category_multiplier,
+        'RRPP': rrpp,
+    }
+    for i, tier in enumerate(tiers, start=1):
+        columns[f'Tier {i}'] = tier_column(tier)
+    return columns
+
+def calculate_pricing(df, total_purchase, freight_cost, currency, exchange_rate, edited_markup, category_multipliers, on_gap="lower", metrics=None, compact=False, freight=None):
+    columns = price_arrays(
+        df['Qty'], df['Purchase Cost'], df['Category'], total_purchase,
+        freight_cost, currency, exchange_rate, edited_markup, category_multipliers, on_gap, metrics, compact,
+        freight, freight_inputs(freight, df) if freight is not None else None,
+    )
+    with measure(metrics, 'assign_columns', len(df)):
+        for name, values in columns.items():
+            df[name] = values
+    return df
+
+def expand_priced_frame(df, edited_markup, category_multipliers, on_gap="lower"):
+    # Full-width copy of a compact priced frame for saving and export; the band code
+    # turns back into the exact markup the row was priced with
+    if 'Markup Band' not in df.columns:
+        return df
+    markup_index = get_markup_index(edited_markup, on_gap)
+    expanded = df.drop(columns=['Markup Band'])
+    expanded['RRPP Markup'] = markup_index.markups_for(df['Markup Band'].to_numpy())
+    expanded['Category Multiplier'] = category_multiplier_array(df['Category'], category_multipliers)
+    for name in PRICED_COLUMNS:
+        expanded[name] = expanded.pop(name)
+    return expanded
+
+def _changed(current, previous):
+    current = current.to_numpy()
+    previous = previous.to_numpy()
+    return ~((current == previous) | (pd.isna(current) & pd.isna(previous)))
+
+def reprice_changed_rows(df, previous, total_purchase, freight_cost, currency, exchange_rate, edited_markup, category_multipliers, on_gap="lower", freight=None):
+    # previous must be the priced frame for the same rows, total_purchase, freight, currency,
+    # exchange rate and rules; callers fall back to calculate_pricing when any of those differ.
+    # A bound freight strategy (freight.bind_freight) keeps invoice-wide totals fixed.
+    # Returns the repriced frame and the number of rows that were recalculated.
+    compact = 'Markup Band' in previous.columns
+    priced = df.copy()
+    for name in COMPACT_PRICED_COLUMNS if compact else PRICED_COLUMNS:
+        priced[name] = previous[name].array.copy()
+
+    cost_changed = _changed(df['Qty'], previous['Qty']) | _changed(df['Purchase Cost'], previous['Purchase Cost'])
+    # Columns the freight allocation reads (a weight, or Category itself) change the landed cost
+    for col in (freight.columns if freight is not None else ()):
+        cost_changed |= _changed(df[col], previous[col])
+    category_changed = _changed(df['Category'], previous['Category']) & ~cost_changed
+
+    if cost_changed.any():
+        rows = priced.index[cost_changed]
+        columns = price_arrays(
+            df.loc[rows, 'Qty'], df.loc[rows, 'Purchase Cost'], df.loc[rows, 'Category'], total_purchase,
+            freight_cost, currency, exchange_rate, edited_markup, category_multipliers, on_gap, compact=compact,
+            freight=freight, freight_columns=freight_inputs(freight, df.loc[rows]) if freight is not None else None,
+        )
+        for name, values in columns.items():
+            priced.loc[rows, name] = values
+
+    if category_changed.any():
+        # Freight allocation does not depend on Category here, so landed cost and markup are reused
+        rows = priced.index[category_changed]
+        if compact:
+            markup_index = get_markup_index(edited_markup, on_gap)
+            band_codes = priced.loc[rows, 'Markup Band'].to_numpy()
+            rrpp_markup = markup_index.markups_for(band_codes)
+        else:
+            rrpp_markup = priced.loc[rows, 'RRPP Markup']
+        columns = category_price_arrays(
+            priced.loc[rows, 'Landed Cost AUD'], rrpp_markup, df.loc[rows, 'Category'], category_multipliers,
+        )
+        if compact:
+            columns = _compact(columns, band_codes, markup_index.code_dtype())
+        for name, values in columns.items():
+            priced.loc[rows, name] = values
+
+    return priced, int(cost_changed.sum() + category_changed.sum())
+
+def calculate_landed_cost(df, total_purchase, freight_cost, currency, exchange_rate, freight=None):
+    df['Purchase Cost AUD'], df['Landed Cost AUD'] = landed_cost_arrays(
+        df['Qty'], df['Purchase Cost'], total_purchase, freight_cost, currency, exchange_rate,
+        freight, freight_inputs(freight, df) if freight is not None else None,
+    )
     return df
 
-def lookup_rrpp_markup(cost, edited_markup):
-    row = edited_markup[(edited_markup['From'] <= cost) & (cost <= edited_markup['To'])]
-    return float(row['RRPP Markup'].iloc[0]) if not row.empty else 1.0
+def lookup_rrpp_markup(cost, edited_markup, on_gap="lower"):
+    return float(lookup_rrpp_markup_array([cost], edited_markup, on_gap)[0])
 
-def calculate_rrpp(df, edited_markup, category_multipliers):
-    df['RRPP Markup'] = df['Landed Cost AUD'].apply(lambda cost: lookup_rrpp_markup(cost, edited_markup))
+def calculate_rrpp(df, edited_markup, category_multipliers, on_gap="lower"):
+    df['RRPP Markup'] = lookup_rrpp_markup_array(df['Landed Cost AUD'], edited_markup, on_gap)
     df['Category Multiplier'] = df['Category'].map(category_multipliers).fillna(1.0)
-    df['RRPP'] = (df['Landed Cost AUD'] * ((df['RRPP Markup'] * df['Category Multiplier']) + 1)).round(0)
+    df['RRPP'] = rrpp_array(df['Landed Cost AUD'].to_numpy(dtype=float), df['RRPP Markup'].to_numpy(), df['Category Multiplier'].to_numpy(dtype=float))
     return df
 
 def calculate_tiered_pricing(df):
-    df['Tier 1'] = df.apply(lambda row: round(row['RRPP'] * 0.95 if row['Category'] in ['Speciality Fast', 'Universal', 'Local'] else row['RRPP'] * 0.9), axis=1)
-    df['Tier 2'] = df.apply(lambda row: round(row['RRPP'] * 1.37) if ((-row['RRPP'] + (row['Tier 1'] * 0.95)) / row['RRPP']) > 0.37 else round(row['Tier 1'] * 0.95), axis=1)
-    df['Tier 3'] = df.apply(lambda row: round(row['RRPP'] * 1.35) if ((-row['RRPP'] + (row['Tier 2'] * 0.9)) / row['RRPP']) > 0.35 else round(row['Tier 2'] * 0.9), axis=1)
-    df['Tier 4'] = df.apply(lambda row: round(row['RRPP'] * 1.3) if ((-row['RRPP'] + (row['Tier 3'] * 0.85)) / row['RRPP']) > 0.3 else round(row['Tier 3'] * 0.85), axis=1)
-    df['Tier 5'] = df.apply(lambda row: round(row['RRPP'] * 1.25) if ((-row['RRPP'] + (row['Tier 4'] * 0.95)) / row['RRPP']) > 0.25 else round(row['Tier 4'] * 0.95), axis=1)
+    tiers = tier_arrays(df['RRPP'], df['Category'].isin(TIER1_REDUCED_DISCOUNT_CATEGORIES).to_numpy())
+    for i, tier in enumerate(tiers, start=1):
+        df[f'Tier {i}'] = tier_column(tier)
     return df
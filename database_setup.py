@@ -1,6 +1,6 @@
 import pandas as pd
-import sqlite3
-from datetime import datetime
+from rule_store import save_category_multipliers, save_markup_table
+from storage import connect
 
 def get_initial_markup_data():
     return pd.DataFrame([
@@ -54,65 +54,13 @@ def get_initial_category_multipliers():
     ], columns=["Category", "Multiplier"])
 
 def main():
-    conn = sqlite3.connect("pricing_engine.db")
-    cursor = conn.cursor()
+    # connect() creates or migrates every table, including the rule tables and their change log
+    conn = connect()
 
-    # Create rrpp_markup_table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS rrpp_markup_table (
-            "From" REAL,
-            "To" REAL,
-            "RRPP Markup" REAL,
-            "timestamp" TEXT,
-            "change_type" TEXT
-        )
-    """)
-
-    # Create category_multipliers table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS category_multipliers (
-            "Category" TEXT,
-            "Multiplier" REAL,
-            "timestamp" TEXT,
-            "change_type" TEXT
-        )
-    """)
-
-    # Insert initial data into rrpp_markup_table
-    markup_data = get_initial_markup_data()
-    markup_data["timestamp"] = datetime.now()
-    markup_data["change_type"] = "initial_load"
-    markup_data.to_sql("rrpp_markup_table", conn, if_exists="replace", index=False)
-
-    # Insert initial data into category_multipliers
-    category_multipliers = get_initial_category_multipliers()
-    category_multipliers["timestamp"] = datetime.now()
-    category_multipliers["change_type"] = "initial_load"
-    category_multipliers.to_sql("category_multipliers", conn, if_exists="replace", index=False)
-
-    # Create priced_parts table with a timestamp column if it doesn't exist
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS priced_parts (
-            "Qty" REAL,
-            "Inv #" TEXT,
-            "Part Number" TEXT,
-            "Purchase Cost" REAL,
-            "Category" TEXT,
-            "Purchase Cost AUD" REAL,
-            "Landed Cost AUD" REAL,
-            "RRPP Markup" REAL,
-            "Category Multiplier" REAL,
-            "RRPP" REAL,
-            "Tier 1" REAL,
-            "Tier 2" REAL,
-            "Tier 3" REAL,
-            "Tier 4" REAL,
-            "Tier 5" REAL,
-            "timestamp" TEXT
-        )
-    """)
-    conn.commit()
+    # Load the initial rules as a new rule version; on an existing database only the rows
+    # that differ from the defaults are rewritten, and the previous rules stay in the log
+    save_markup_table(conn, get_initial_markup_data(), "initial_load")
+    save_category_multipliers(conn, get_initial_category_multipliers(), "initial_load")
 
     conn.close()
     print("Database initialized successfully.")
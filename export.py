@@ -0,0 +1,143 @@
+import bz2
+import gzip
+import importlib.util
+import io
+import lzma
+import os
+import tempfile
+from contextlib import ExitStack
+from instrumentation import measure
+
+# Priced output is written chunk by chunk to a path or an open binary file (a temp file
+# for downloads), so no export is ever held as one string. The app and the CLI share this.
+
+EXPORT_FORMATS = ["csv", "parquet", "xlsx"]
+EXPORT_DROP_COLUMNS = ["timestamp", "RRPP Markup", "Category Multiplier"]
+EXPORT_CHUNK_ROWS = 50_000
+# Compression name -> (wrapper for an open binary file, file suffix); none of them close the file they wrap
+CSV_COMPRESSIONS = {
+    "gzip": (lambda out: gzip.GzipFile(fileobj=out, mode="wb"), ".gz"),
+    "bz2": (lambda out: bz2.BZ2File(out, "wb"), ".bz2"),
+    "xz": (lambda out: lzma.LZMAFile(out, "wb"), ".xz"),
+}
+PARQUET_COMPRESSIONS = ["snappy", "zstd", "gzip"]
+# One sheet holds at most 1,048,576 rows including the header; longer exports continue on a new sheet
+XLSX_SHEET_ROWS = 1_048_575
+XLSX_SHEET_NAME = "Priced Parts"
+
+MIME_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def _check_options(fmt, compression):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+    allowed = {"csv": CSV_COMPRESSIONS, "parquet": PARQUET_COMPRESSIONS, "xlsx": []}[fmt]
+    if compression is not None and compression not in allowed:
+        raise ValueError(f"{fmt} export does not support {compression!r} compression")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("Parquet export needs pyarrow; install it or choose another format")
+
+def export_suffix(fmt, compression=None):
+    # Parquet compresses inside the file and xlsx is already a zip, so only CSV gets an extra suffix
+    suffix = f".{fmt}"
+    if fmt == "csv" and compression:
+        suffix += CSV_COMPRESSIONS[compression][1]
+    return suffix
+
+def export_mime(fmt, compression=None):
+    return "application/octet-stream" if fmt == "csv" and compression else MIME_TYPES[fmt]
+
+def frame_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    # An empty frame is still yielded once, so its columns reach the export
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def _write_csv(chunks, out, compression, drop_columns, metrics):
+    rows_written = 0
+    with ExitStack() as stack:
+        if compression:
+            out = stack.enter_context(CSV_COMPRESSIONS[compression][0](out))
+        text = io.TextIOWrapper(out, newline="")
+        # Detached rather than closed, since closing the wrapper would close out as well
+        stack.callback(text.detach)
+        for chunk in chunks:
+            with measure(metrics, 'write', len(chunk)):
+                chunk.drop(columns=drop_columns, errors='ignore').to_csv(text, header=rows_written == 0, index=False)
+            rows_written += len(chunk)
+    return rows_written
+
+def _write_parquet(chunks, out, compression, drop_columns, metrics):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows_written = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            with measure(metrics, 'write', len(chunk)):
+                chunk = chunk.drop(columns=drop_columns, errors='ignore')
+                # The first chunk fixes the schema; later chunks are cast to it
+                table = pa.Table.from_pandas(chunk, preserve_index=False, schema=writer.schema if writer else None)
+                if writer is None:
+                    writer = pq.ParquetWriter(out, table.schema, compression=compression or "none")
+                writer.write_table(table)
+            rows_written += len(chunk)
+        if writer is None:
+            # No chunks at all: still a valid (empty) Parquet file rather than zero bytes
+            pq.write_table(pa.table({}), out, compression=compression or "none")
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+def _write_xlsx(chunks, out, drop_columns, metrics):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, header = None, 0, None
+    rows_written = 0
+    for chunk in chunks:
+        with measure(metrics, 'write', len(chunk)):
+            chunk = chunk.drop(columns=drop_columns, errors='ignore')
+            header = header or [str(col) for col in chunk.columns]
+            # Missing values become empty cells
+            values = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            for row in values:
+                if sheet is None or sheet_rows == XLSX_SHEET_ROWS:
+                    sheet = workbook.create_sheet(XLSX_SHEET_NAME if sheet is None else f"{XLSX_SHEET_NAME} {len(workbook.worksheets) + 1}")
+                    sheet.append(header)
+                    sheet_rows = 0
+                sheet.append(row)
+                sheet_rows += 1
+        rows_written += len(chunk)
+    if sheet is None:
+        workbook.create_sheet(XLSX_SHEET_NAME).append(header or [])
+    workbook.save(out)
+    return rows_written
+
+def write_export(chunks, output, fmt="csv", compression=None, drop_columns=EXPORT_DROP_COLUMNS, metrics=None):
+    # Writes an iterable of priced frames to output (a path or a binary file object) and
+    # returns the number of rows written
+    _check_options(fmt, compression)
+    with ExitStack() as stack:
+        out = stack.enter_context(open(output, "wb")) if isinstance(output, (str, os.PathLike)) else output
+        if fmt == "csv":
+            return _write_csv(chunks, out, compression, drop_columns, metrics)
+        if fmt == "parquet":
+            return _write_parquet(chunks, out, compression, drop_columns, metrics)
+        return _write_xlsx(chunks, out, drop_columns, metrics)
+
+def export_to_tempfile(chunks, fmt="csv", compression=None, drop_columns=EXPORT_DROP_COLUMNS, directory=None):
+    # Returns (path, rows written); the caller removes the file once it has been served
+    _check_options(fmt, compression)
+    handle, path = tempfile.mkstemp(prefix="priced_parts_", suffix=export_suffix(fmt, compression), dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as out:
+            rows_written = write_export(chunks, out, fmt, compression, drop_columns)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows_written
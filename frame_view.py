@@ -0,0 +1,87 @@
+import math
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Server-side paging for large frames: filtering, sorting and aggregation run here and only
+# the visible page is sent to the browser. Filtered, sorted row positions are cached per
+# frame object and view settings, so paging through a result does not re-sort it.
+
+PAGE_SIZES = [50, 100, 500, 1000]
+DEFAULT_PAGE_SIZE = 100
+SUMMARY_COLUMNS = ["Purchase Cost", "Landed Cost AUD", "RRPP", "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5"]
+
+def view_positions(df, categories=None, row_masks=(), sort_by=None, ascending=True):
+    # Row positions that pass every filter, in display order
+    keep = np.ones(len(df), dtype=bool)
+    if categories:
+        keep &= df["Category"].isin(categories).to_numpy()
+    for mask in row_masks:
+        keep &= np.asarray(mask, dtype=bool)
+    positions = np.flatnonzero(keep)
+    if sort_by:
+        values = df[sort_by].iloc[positions].reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+        positions = positions[order]
+    return positions
+
+def page_count(rows, page_size):
+    return max(1, math.ceil(rows / page_size))
+
+def page_rows(df, positions, page, page_size):
+    start = (page - 1) * page_size
+    return df.iloc[positions[start:start + page_size]]
+
+def summarize_rows(df, positions):
+    # Quantity-weighted totals of the filtered rows, overall and per category
+    view = df.iloc[positions]
+    qty = view["Qty"].to_numpy(dtype=float)
+    columns = [col for col in SUMMARY_COLUMNS if col in view.columns]
+    totals = pd.DataFrame({f"{col} Total": view[col].to_numpy(dtype=float) * qty for col in columns}, index=view.index)
+    totals.insert(0, "Qty", qty)
+    totals.insert(0, "Rows", 1)
+    by_category = totals.groupby(view["Category"].to_numpy(), sort=True).sum()
+    by_category.index.name = "Category"
+    return totals.sum(), by_category
+
+def frame_view_controls(df, key, row_filters=None, version=None):
+    # Renders the filter, sort and page widgets for df and returns (positions, visible page).
+    # row_filters maps a checkbox label to a boolean mask over df's rows; callers change
+    # version whenever df is edited in place or the masks change.
+    row_filters = row_filters or {}
+    filter_col, sort_col, order_col = st.columns([3, 2, 1])
+    with filter_col:
+        categories = st.multiselect("Filter categories", options=sorted(df["Category"].dropna().unique().tolist()), key=f"{key}_categories")
+    with sort_col:
+        sort_by = st.selectbox("Sort by", options=["(file order)"] + list(df.columns), key=f"{key}_sort_by")
+    with order_col:
+        ascending = st.radio("Order", options=["Ascending", "Descending"], key=f"{key}_order") == "Ascending"
+    filters = [label for label in row_filters if st.checkbox(label, key=f"{key}_{label}")]
+    sort_by = None if sort_by == "(file order)" else sort_by
+
+    params = (version, tuple(categories), tuple(filters), sort_by, ascending)
+    cache = st.session_state.get(f"{key}_positions")
+    if cache is None or cache["frame"] is not df or cache["params"] != params:
+        positions = view_positions(df, categories, [row_filters[label] for label in filters], sort_by, ascending)
+        cache = {"frame": df, "params": params, "positions": positions}
+        st.session_state[f"{key}_positions"] = cache
+    positions = cache["positions"]
+
+    size_col, page_col, count_col = st.columns([1, 1, 2])
+    with size_col:
+        page_size = st.selectbox("Rows per page", options=PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE), key=f"{key}_page_size")
+    pages = page_count(len(positions), page_size)
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    with count_col:
+        st.caption(f"{len(positions):,} of {len(df):,} row(s) match; page {page} of {pages}.")
+    return positions, page_rows(df, positions, page, page_size)
+
+def view_summary(key):
+    # summarize_rows for the rows frame_view_controls last selected, computed once per selection
+    cache = st.session_state[f"{key}_positions"]
+    if "summary" not in cache:
+        cache["summary"] = summarize_rows(cache["frame"], cache["positions"])
+    return cache["summary"]
@@ -0,0 +1,179 @@
+import json
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Freight allocation strategies. Each one turns the invoice into an AUD freight amount per
+# unit with whole-column array arithmetic; landed_cost_arrays adds it to the AUD purchase
+# cost. Strategies are immutable namedtuples, so they compare, hash and pickle by value
+# and can be part of the page's repricing key or shipped to worker processes.
+#
+# A strategy provides:
+#   name              registry key, also used in specs and on the command line
+#   columns           extra per-line input columns it reads (beyond Qty and Purchase Cost)
+#   invoice_totals()  additive sums over the rows it is given, for strategies that share
+#                     freight across the whole invoice; bind() fixes them, so an invoice
+#                     priced in chunks allocates exactly as it would in one piece
+#   freight_per_unit()  required
+
+class FreightStrategy(ABC):
+    name = None
+    columns = ()
+
+    def __new__(cls, *args, **kwargs):
+        # tuple.__new__ skips ABC's check, so a strategy missing freight_per_unit is
+        # refused here rather than halfway through pricing
+        if cls.__abstractmethods__:
+            raise TypeError(f"Can't instantiate freight strategy {cls.__name__} without {', '.join(sorted(cls.__abstractmethods__))}")
+        return super().__new__(cls, *args, **kwargs)
+
+    # Strategies of different kinds never compare equal, even with equal parameters
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.name, tuple(self)))
+
+    def invoice_totals(self, qty, inputs):
+        return ()
+
+    def bind(self, totals):
+        return self
+
+    @property
+    def is_bound(self):
+        return True
+
+    @abstractmethod
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        # Freight per unit in AUD for every row, or None when no freight is added
+        ...
+
+def _numeric(values):
+    # Extra columns arrive as text from ingestion; unreadable values count as zero
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        try:
+            values = values.replace("", np.nan).astype(float)
+        except (TypeError, ValueError):
+            # Only text with units or separators ("2.5 kg", "1,200") takes the slower cleaning path
+            values = pd.to_numeric(values.astype(str).str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce')
+    return np.nan_to_num(values.to_numpy(dtype=float), nan=0.0)
+
+class ValueAllocation(FreightStrategy, namedtuple("ValueAllocation", [])):
+    # The default: freight_cost shared in proportion to each line's purchase value. The
+    # invoice total is the total_purchase argument callers already pass.
+    name = "value"
+
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        if not total_purchase > 0:
+            return None
+        return (((qty * purchase_cost) / total_purchase) * freight_cost) / qty
+
+class WeightAllocation(FreightStrategy, namedtuple("WeightAllocation", ["column", "total_weight"], defaults=("Weight", None))):
+    # freight_cost shared in proportion to each line's weight (column holds weight per unit)
+    name = "weight"
+
+    @property
+    def columns(self):
+        return (self.column,)
+
+    @property
+    def is_bound(self):
+        return self.total_weight is not None
+
+    def invoice_totals(self, qty, inputs):
+        return (float(np.sum(qty * _numeric(inputs[self.column]))),)
+
+    def bind(self, totals):
+        return self._replace(total_weight=totals[0])
+
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        weight = _numeric(inputs[self.column])
+        total_weight = self.total_weight if self.is_bound else float(np.sum(qty * weight))
+        if not total_weight > 0:
+            return None
+        return weight * (freight_cost / total_weight)
+
+class PerLineAllocation(FreightStrategy, namedtuple("PerLineAllocation", ["amount"], defaults=(0.0,))):
+    # A fixed AUD amount per invoice line, spread over the line's quantity
+    name = "per_line"
+
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        return self.amount / qty
+
+class PercentageAllocation(FreightStrategy, namedtuple("PercentageAllocation", ["pct"], defaults=(0.0,))):
+    # A percentage of each unit's AUD purchase cost
+    name = "percentage"
+
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        return purchase_cost_aud * (self.pct / 100)
+
+class CategoryAllocation(FreightStrategy, namedtuple("CategoryAllocation", ["rates", "default_pct"], defaults=((), 0.0))):
+    # A percentage of AUD purchase cost that depends on the line's category; rates is a
+    # tuple of (category, pct) pairs so the strategy stays hashable
+    name = "category"
+    columns = ("Category",)
+
+    def freight_per_unit(self, qty, purchase_cost, purchase_cost_aud, inputs, total_purchase, freight_cost):
+        categories = pd.Series(inputs["Category"])
+        if isinstance(categories.dtype, pd.CategoricalDtype):
+            codes, names = categories.cat.codes.to_numpy(), categories.cat.categories
+        else:
+            codes, names = pd.factorize(categories)
+        # One lookup per distinct category, gathered by code; the last slot (code -1) is the default
+        rates = dict(self.rates)
+        by_code = np.array([rates.get(c, self.default_pct) for c in names] + [self.default_pct], dtype=float)
+        return purchase_cost_aud * (by_code[codes] / 100)
+
+FREIGHT_STRATEGIES = {}
+
+def register_freight_strategy(strategy_class):
+    FREIGHT_STRATEGIES[strategy_class.name] = strategy_class
+    return strategy_class
+
+for _strategy in (ValueAllocation, WeightAllocation, PerLineAllocation, PercentageAllocation, CategoryAllocation):
+    register_freight_strategy(_strategy)
+
+DEFAULT_FREIGHT = ValueAllocation()
+
+def freight_strategy(name="value", **params):
+    if name not in FREIGHT_STRATEGIES:
+        raise ValueError(f"Unknown freight allocation {name!r}; expected one of {', '.join(FREIGHT_STRATEGIES)}")
+    if name == "category" and isinstance(params.get("rates"), dict):
+        params["rates"] = tuple(params["rates"].items())
+    return FREIGHT_STRATEGIES[name](**params)
+
+def freight_inputs(freight, df):
+    # The extra columns freight reads, taken from df
+    missing = [col for col in freight.columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"Freight allocation {freight.name!r} needs column(s) {', '.join(missing)}")
+    return {col: df[col] for col in freight.columns}
+
+def bind_freight(freight, df):
+    # Fixes invoice-wide totals from the whole invoice before it is priced in chunks
+    if freight is None or freight.is_bound:
+        return freight
+    return freight.bind(freight.invoice_totals(df['Qty'].to_numpy(dtype=float), freight_inputs(freight, df)))
+
+def freight_spec(freight):
+    # JSON text recorded with saved runs; None for the default
+    if freight is None or freight == DEFAULT_FREIGHT:
+        return None
+    if not isinstance(freight, FreightStrategy):
+        raise TypeError(f"Expected a freight strategy, got {type(freight).__name__}")
+    params = {key: list(map(list, value)) if key == "rates" else value for key, value in freight._asdict().items()}
+    return json.dumps({"name": freight.name, **params})
+
+def freight_from_spec(spec):
+    if not spec:
+        return DEFAULT_FREIGHT
+    params = json.loads(spec)
+    if "rates" in params:
+        params["rates"] = tuple((category, pct) for category, pct in params["rates"])
+    return freight_strategy(**params)
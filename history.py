@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from storage import LATEST_PRICE_COLUMNS
+
+DELTA_COLUMNS = ["RRPP", "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5"]
+DEFAULT_THRESHOLD_PCT = 10.0
+
+def load_latest_prices(conn, part_numbers):
+    # Join against a temp table of the invoice's part numbers so only those rows are read
+    part_numbers = pd.Series(part_numbers).dropna().astype(str).unique()
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS invoice_parts ("Part Number" TEXT PRIMARY KEY)')
+    conn.execute("DELETE FROM invoice_parts")
+    conn.executemany('INSERT OR IGNORE INTO invoice_parts VALUES (?)', ((part,) for part in part_numbers))
+    selected = ", ".join(f'l."{col}"' for col in ["Part Number"] + LATEST_PRICE_COLUMNS + ["timestamp", "run_id"])
+    latest = pd.read_sql(f'SELECT {selected} FROM latest_prices l JOIN invoice_parts USING ("Part Number")', conn)
+    conn.execute("DELETE FROM invoice_parts")
+    conn.commit()
+    return latest
+
+def price_deltas(priced_df, latest, threshold_pct=DEFAULT_THRESHOLD_PCT):
+    report = priced_df[["Part Number"] + [col for col in ["Category"] + DELTA_COLUMNS if col in priced_df.columns]].copy()
+    report["Part Number"] = report["Part Number"].astype(str)
+    previous = latest.set_index("Part Number")
+    flagged = np.zeros(len(report), dtype=bool)
+    report["Last Priced"] = report["Part Number"].map(previous["timestamp"])
+    for col in DELTA_COLUMNS:
+        if col not in report.columns:
+            continue
+        before = report["Part Number"].map(previous[col]).to_numpy(dtype=float)
+        after = report[col].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change_pct = (after - before) / before * 100
+        report[f"Previous {col}"] = before
+        report[f"{col} Change"] = after - before
+        report[f"{col} Change %"] = change_pct
+        flagged |= np.abs(change_pct) > threshold_pct
+    report["Flagged"] = flagged
+    return report
+
+def price_delta_report(conn, priced_df, threshold_pct=DEFAULT_THRESHOLD_PCT):
+    return price_deltas(priced_df, load_latest_prices(conn, priced_df["Part Number"]), threshold_pct)
@@ -0,0 +1,222 @@
+import csv
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+
+# Every cell is read as text and typed once in clean_purchase_frame. Reading text also
+# keeps "N/A" (a valid category) and leading zeros in part numbers intact.
+CSV_READ_OPTIONS = {"dtype": str, "keep_default_na": False}
+PARSE_CACHE_SIZE = 4
+MAX_LOAD_WORKERS = 8
+# Rows that are identical in these columns and arrive in more than one file are kept once
+DEDUP_COLUMNS = ['Qty', 'Inv #', 'Part Number', 'Purchase Cost', 'Category']
+
+def _has_module(name):
+    return importlib.util.find_spec(name) is not None
+
+def excel_engine(name):
+    if _has_module("python_calamine"):
+        return "calamine"
+    return "openpyxl" if name.lower().endswith(".xlsx") else None
+
+def _read_csv_pyarrow(data):
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    # pandas' pyarrow engine infers numbers first and casts to text afterwards, which
+    # drops leading zeros, so every column is declared as text up front instead
+    first_line = data.split(b"\n", 1)[0].decode("utf-8-sig")
+    names = next(csv.reader([first_line]), [])
+    convert_options = pa_csv.ConvertOptions(column_types={name: pa.string() for name in names})
+    return pa_csv.read_csv(io.BytesIO(data), convert_options=convert_options).to_pandas()
+
+def read_purchase_frame(source, name):
+    if name.lower().endswith(".csv"):
+        if _has_module("pyarrow"):
+            if hasattr(source, "getvalue"):
+                return _read_csv_pyarrow(source.getvalue())
+            with open(source, "rb") as f:
+                return _read_csv_pyarrow(f.read())
+        return pd.read_csv(source, **CSV_READ_OPTIONS)
+    return pd.read_excel(source, engine=excel_engine(name), dtype=str, keep_default_na=False)
+
+def _strip_text(series):
+    if pd.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        return series.str.strip()
+    return series.map(lambda value: value.strip() if isinstance(value, str) else value)
+
+def _to_number(series, pattern):
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series
+    return pd.to_numeric(series.astype(str).str.replace(pattern, '', regex=True), errors='coerce')
+
+def clean_purchase_cost(series):
+    return _to_number(series, r'[^0-9.]').astype(float)
+
+def clean_qty(series):
+    return _to_number(series, r'[,\s]').fillna(0).astype(int)
+
+def clean_purchase_frame(df, default_category=""):
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.strip()
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col].dtype):
+            df[col] = _strip_text(df[col])
+
+    df['Purchase Cost'] = clean_purchase_cost(df['Purchase Cost'])
+    df['Qty'] = clean_qty(df['Qty'])
+    # Optional per-unit weight, read by the weight-based freight allocation
+    if 'Weight' in df.columns:
+        df['Weight'] = clean_purchase_cost(df['Weight'])
+
+    if 'Category' not in df.columns:
+        df['Category'] = default_category
+    df['Category'] = df['Category'].fillna(default_category).astype(str)
+    df['Category'] = df['Category'].replace("", default_category)
+    return df
+
+def _compact_string_dtype():
+    # Arrow-backed text that still uses NaN for missing values, as pandas 3 does by
+    # default; older pandas without it keeps object columns
+    if not _has_module("pyarrow"):
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=float("nan"))
+    except TypeError:
+        return None
+
+def compact_purchase_frame(df, categories=()):
+    # Category becomes a categorical that already holds every valid category, so the
+    # editor can switch a row to any of them; identifiers move to Arrow-backed strings
+    # and Qty to int32. Purchase Cost stays float64 so prices do not change.
+    df['Category'] = pd.Categorical(
+        df['Category'], categories=list(dict.fromkeys([*categories, *df['Category'].dropna().unique()])),
+    )
+    string_dtype = _compact_string_dtype()
+    for col in ('Part Number', 'Inv #'):
+        if col in df.columns and string_dtype is not None:
+            df[col] = df[col].astype(string_dtype)
+    df['Qty'] = df['Qty'].astype('int32')
+    return df
+
+def file_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+def _read_source(source, name=None):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return name or os.fspath(source), f.read()
+    data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+    return name or getattr(source, "name", ""), data
+
+def _parse_bytes(data, name, default_category, categories):
+    # categories=None keeps plain columns; a list (even empty) returns the compact frame
+    df = clean_purchase_frame(read_purchase_frame(io.BytesIO(data), name), default_category)
+    if categories is not None:
+        df = compact_purchase_frame(df, categories)
+    return df
+
+def _load_bytes(data, name, default_category, categories, parse=_parse_bytes):
+    key = (file_digest(data), os.path.splitext(name)[1].lower(), default_category,
+           None if categories is None else tuple(categories))
+    with _parse_cache_lock:
+        if key in _parse_cache:
+            _parse_cache.move_to_end(key)
+            return _parse_cache[key].copy()
+    df = parse(data, name, default_category, categories)
+    with _parse_cache_lock:
+        _parse_cache[key] = df
+        if len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return df.copy()
+
+def load_purchase_file(source, name=None, default_category="", categories=None):
+    # Parsed frames are cached by file contents, so re-uploading or re-reading the
+    # same file skips parsing entirely
+    name, data = _read_source(source, name)
+    return _load_bytes(data, name, default_category, categories)
+
+def invalid_category_mask(categories, valid_categories):
+    # A compact frame's categorical is checked once per distinct category, not once per row
+    if isinstance(categories.dtype, pd.CategoricalDtype):
+        valid = categories.cat.categories.isin(valid_categories)
+        codes = categories.cat.codes.to_numpy()
+        return pd.Series((codes < 0) | ~valid[codes], index=categories.index)
+    return ~categories.isin(valid_categories)
+
+def _validate_file(name, data, default_category, categories, parse=_parse_bytes):
+    # Parses, cleans and validates one file; failures are reported in its summary
+    summary = {"File": name, "Rows": 0, "Duplicate Rows": 0, "Invalid Categories": 0, "Missing Costs": 0, "Error": ""}
+    try:
+        df = _load_bytes(data, name, default_category, categories, parse)
+    except Exception as e:
+        summary["Error"] = f"{type(e).__name__}: {e}"
+        return summary, None, None
+    if categories is None:
+        invalid = pd.Series(False, index=df.index)
+    else:
+        invalid = invalid_category_mask(df['Category'], categories)
+    summary.update({"Rows": len(df), "Invalid Categories": int(invalid.sum()), "Missing Costs": int(df['Purchase Cost'].isna().sum())})
+    return summary, df, invalid.to_numpy()
+
+def _is_excel(name):
+    return not name.lower().endswith(".csv")
+
+def load_purchase_files(sources, default_category="", categories=None, workers=None):
+    # Parses and validates several files and merges them into one invoice. Returns
+    # (merged frame, invalid-category mask for its rows, one summary row per file).
+    # Files are handled in a thread pool, which suits CSV: pyarrow's reader runs outside
+    # the GIL. The Excel readers (openpyxl, xlrd) are pure Python and hold it, so when
+    # there are several Excel files they are parsed in worker processes instead, and
+    # their threads only wait for the result.
+    files = [_read_source(source) for source in sources]
+    workers = max(1, min(workers or MAX_LOAD_WORKERS, len(files)))
+    excel_files = sum(_is_excel(name) for name, _ in files)
+    processes = min(workers, excel_files, os.cpu_count() or 1)
+    process_pool = None
+    if processes > 1:
+        # spawn, not fork: the Streamlit server process is multi-threaded
+        process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def validate(file):
+        name, data = file
+        if process_pool is not None and _is_excel(name):
+            # Cached files never reach the pool
+            parse = lambda *args: process_pool.submit(_parse_bytes, *args).result()
+            return _validate_file(name, data, default_category, categories, parse)
+        return _validate_file(name, data, default_category, categories)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(validate, files))
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+    summaries = pd.DataFrame([summary for summary, _, _ in results])
+
+    loaded = [(position, df, invalid) for position, (_, df, invalid) in enumerate(results) if df is not None]
+    if not loaded:
+        return None, None, summaries
+    merged = pd.concat([df.assign(_file=position) for position, df, _ in loaded], ignore_index=True)
+    invalid = pd.Series([flag for _, _, mask in loaded for flag in mask], dtype=bool)
+
+    # A row repeated inside one file is a real second line; the same row in a later file is a re-export
+    key_columns = [col for col in DEDUP_COLUMNS if col in merged.columns]
+    first_file = merged.groupby(key_columns, dropna=False, observed=True, sort=False)['_file'].transform('min')
+    keep = (merged['_file'] == first_file).to_numpy()
+    summaries['Duplicate Rows'] = merged.loc[~keep, '_file'].value_counts().reindex(summaries.index, fill_value=0).to_numpy()
+
+    merged = merged[keep].drop(columns='_file').reset_index(drop=True)
+    if categories is not None:
+        # Files that brought different unknown categories concatenate to plain text
+        merged = compact_purchase_frame(merged, categories)
+    return merged, invalid[keep].reset_index(drop=True), summaries
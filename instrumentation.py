@@ -0,0 +1,92 @@
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+logger = logging.getLogger("pricing_engine.metrics")
+
+class PipelineMetrics:
+    # Accumulates wall time, rows and allocation per named stage. A stage that runs more
+    # than once (one call per chunk, say) is summed into a single record. Stages are
+    # meant to be measured one after another, not nested, because allocation tracking
+    # resets the tracemalloc peak at the start of every stage.
+
+    def __init__(self, track_memory=False, **labels):
+        self.track_memory = track_memory
+        self.labels = labels
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        started_tracing = self.track_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracing = self.track_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1] - baseline if tracing else None
+            if started_tracing:
+                tracemalloc.stop()
+            self._record(name, elapsed, rows, allocated)
+
+    def _record(self, name, seconds, rows, allocated):
+        record = self.stages.setdefault(name, {"seconds": 0.0, "rows": None, "calls": 0, "alloc_bytes": None})
+        record["seconds"] += seconds
+        record["calls"] += 1
+        if rows is not None:
+            record["rows"] = (record["rows"] or 0) + rows
+        if allocated is not None:
+            record["alloc_bytes"] = max(record["alloc_bytes"] or 0, allocated)
+
+    def records(self):
+        records = []
+        for name, stage in self.stages.items():
+            rows = stage["rows"]
+            records.append({
+                **self.labels,
+                "stage": name,
+                "seconds": stage["seconds"],
+                "rows": rows,
+                "rows_per_sec": rows / stage["seconds"] if rows and stage["seconds"] > 0 else None,
+                "alloc_mb": stage["alloc_bytes"] / 2**20 if stage["alloc_bytes"] is not None else None,
+                "calls": stage["calls"],
+            })
+        return records
+
+    def total_seconds(self):
+        return sum(stage["seconds"] for stage in self.stages.values())
+
+    def to_frame(self):
+        return pd.DataFrame(self.records())
+
+    def log(self):
+        log_records(self.records())
+
+    def write(self, path):
+        write_metrics(path, self.records())
+
+def measure(metrics, name, rows=None):
+    # Lets instrumented code take metrics=None without branching at every stage
+    return metrics.stage(name, rows) if metrics is not None else nullcontext()
+
+def log_records(records):
+    for record in records:
+        logger.info(json.dumps(record, default=str))
+
+def write_metrics(path, records):
+    # JSON Lines, appended, so the CLI, the benchmarks and the app can share one file
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps({"timestamp": time.time(), **record}, default=str) + "\n")
+
+def read_metrics(path):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
@@ -0,0 +1,269 @@
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from calculations import calculate_pricing
+from freight import bind_freight, freight_from_spec, freight_spec
+from snapshots import compile_snapshot, load_snapshot
+from storage import DB_PATH, checkpoint, connect
+
+# Background pricing jobs. A job's input frame is split into row chunks once the invoice
+# total_purchase is known; chunks are queued in SQLite (pricing_jobs / pricing_job_chunks)
+# and claimed one at a time by a pool of local worker processes. Chunk files live in a
+# private directory next to the database until the result is collected; they are Parquet,
+# never pickles, so nothing a worker reads from disk can run code. Jobs always price
+# against a rule snapshot, so a rule edit made while a job runs cannot split it across
+# two rule sets.
+
+JOB_DIR_NAME = "pricing_jobs"
+JOB_CHUNK_ROWS = 50_000
+MIN_JOB_CHUNK_ROWS = 10_000
+POLL_INTERVAL = 0.2
+WORKER_IDLE_SECONDS = 60
+JOB_RETENTION_SECONDS = 24 * 3600
+ACTIVE_STATUSES = ("queued", "running")
+
+def _now():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def plan_chunks(rows, workers, chunk_rows=JOB_CHUNK_ROWS):
+    # Enough chunks to keep every worker busy, none larger than chunk_rows
+    size = max(MIN_JOB_CHUNK_ROWS, min(chunk_rows, math.ceil(rows / max(workers, 1))))
+    return [(start, min(start + size, rows)) for start in range(0, rows, size)] or [(0, 0)]
+
+def job_directory(db_path=DB_PATH):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), JOB_DIR_NAME)
+
+def _private_dir(path):
+    # Owner-only, also when the directory already existed with wider permissions
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+
+def _chunk_file(job_path, kind, chunk):
+    return os.path.join(job_path, f"{kind}_{chunk}.parquet")
+
+def _freight_file(job_path):
+    return os.path.join(job_path, "freight.json")
+
+def submit_job(df, freight_cost, currency, exchange_rate, total_purchase=None, rules_snapshot=None, on_gap="lower",
+               source=None, db_path=DB_PATH, job_dir=None, workers=None, chunk_rows=JOB_CHUNK_ROWS, freight=None):
+    # Queues df for pricing and returns the job_id; without a snapshot the live rules are
+    # compiled into one first. freight is bound to the whole invoice before it is split.
+    if rules_snapshot is None:
+        rules_snapshot = compile_snapshot(db_path)
+    if total_purchase is None:
+        total_purchase = (df['Qty'].astype(float) * df['Purchase Cost'].astype(float)).sum()
+    chunks = plan_chunks(len(df), workers or default_workers(), chunk_rows)
+    freight = bind_freight(freight, df)
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            job_id = conn.execute(
+                'INSERT INTO pricing_jobs ("status", "created", "row_count", "chunk_count", "currency", "exchange_rate", '
+                '"freight_cost", "total_purchase", "on_gap", "rules_snapshot", "source") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ("preparing", _now(), len(df), len(chunks), currency, exchange_rate, freight_cost, float(total_purchase),
+                 on_gap, rules_snapshot, source),
+            ).lastrowid
+        job_dir = os.path.abspath(job_dir or job_directory(db_path))
+        _private_dir(job_dir)
+        job_path = os.path.join(job_dir, f"job_{job_id}")
+        _private_dir(job_path)
+        spec = freight_spec(freight)
+        if spec is not None:
+            with open(_freight_file(job_path), "w") as f:
+                f.write(spec)
+        for chunk, (start, stop) in enumerate(chunks):
+            df.iloc[start:stop].to_parquet(_chunk_file(job_path, "input", chunk))
+        with conn:
+            conn.executemany(
+                'INSERT INTO pricing_job_chunks ("job_id", "chunk", "start_row", "stop_row", "status") VALUES (?, ?, ?, ?, ?)',
+                [(job_id, chunk, start, stop, "queued") for chunk, (start, stop) in enumerate(chunks)],
+            )
+            conn.execute('UPDATE pricing_jobs SET "status" = ?, "job_path" = ? WHERE "job_id" = ?', ("queued", job_path, job_id))
+        checkpoint(conn)
+        cleanup_jobs(conn)
+    finally:
+        conn.close()
+    return job_id
+
+# The next queued chunk of a job that is still active
+NEXT_CHUNK_QUERY = '''
+    SELECT c.rowid FROM pricing_job_chunks c JOIN pricing_jobs j ON j."job_id" = c."job_id"
+    WHERE c."status" = 'queued' AND j."status" IN ('queued', 'running')
+    ORDER BY c."job_id", c."chunk" LIMIT 1
+'''
+
+def _claim_chunk(conn, pid):
+    # Polling an empty queue is a read only; nothing is written until there is a chunk
+    if conn.execute(NEXT_CHUNK_QUERY).fetchone() is None:
+        return None
+    # A single UPDATE ... RETURNING, so two workers can never claim the same chunk
+    row = conn.execute(f'''
+        UPDATE pricing_job_chunks SET "status" = 'running', "worker_pid" = ?
+        WHERE rowid = ({NEXT_CHUNK_QUERY})
+        RETURNING "job_id", "chunk"
+    ''', (pid,)).fetchone()
+    if row is None:
+        conn.commit()
+        return None
+    conn.execute('UPDATE pricing_jobs SET "status" = \'running\', "started" = COALESCE("started", ?) WHERE "job_id" = ? AND "status" = \'queued\'',
+                 (_now(), row[0]))
+    conn.commit()
+    return row
+
+def _job_row(conn, job_id):
+    cursor = conn.execute('SELECT * FROM pricing_jobs WHERE "job_id" = ?', (job_id,))
+    row = cursor.fetchone()
+    return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+def _price_chunk(job, chunk):
+    rules = load_snapshot(job["rules_snapshot"], on_gap=job["on_gap"])
+    df = pd.read_parquet(_chunk_file(job["job_path"], "input", chunk))
+    df['Purchase Cost'] = df['Purchase Cost'].astype(float)
+    freight = None
+    if os.path.exists(_freight_file(job["job_path"])):
+        with open(_freight_file(job["job_path"])) as f:
+            freight = freight_from_spec(f.read())
+    priced = calculate_pricing(df, job["total_purchase"], job["freight_cost"], job["currency"], job["exchange_rate"],
+                               rules.markup_index, rules.category_multipliers, job["on_gap"], compact=True, freight=freight)
+    priced.to_parquet(_chunk_file(job["job_path"], "output", chunk))
+    os.remove(_chunk_file(job["job_path"], "input", chunk))
+
+def _finish_job(conn, job):
+    # Run by whichever worker completes the last chunk
+    parts = [pd.read_parquet(_chunk_file(job["job_path"], "output", chunk)) for chunk in range(job["chunk_count"])]
+    pd.concat(parts).to_parquet(os.path.join(job["job_path"], "result.parquet"))
+    for chunk in range(job["chunk_count"]):
+        os.remove(_chunk_file(job["job_path"], "output", chunk))
+    with conn:
+        conn.execute('UPDATE pricing_jobs SET "status" = \'done\', "finished" = ? WHERE "job_id" = ?', (_now(), job["job_id"]))
+    checkpoint(conn)
+
+def _fail_job(conn, job_id, chunk, error):
+    with conn:
+        conn.execute('UPDATE pricing_job_chunks SET "status" = \'failed\' WHERE "job_id" = ? AND "chunk" = ?', (job_id, chunk))
+        conn.execute('UPDATE pricing_jobs SET "status" = \'failed\', "finished" = ?, "error" = ? WHERE "job_id" = ?',
+                     (_now(), error, job_id))
+    checkpoint(conn)
+
+def run_next_chunk(conn, pid=None):
+    # Claims and prices one queued chunk; returns False when the queue is empty
+    claimed = _claim_chunk(conn, pid or os.getpid())
+    if claimed is None:
+        return False
+    job_id, chunk = claimed
+    job = _job_row(conn, job_id)
+    try:
+        _price_chunk(job, chunk)
+        with conn:
+            conn.execute('UPDATE pricing_job_chunks SET "status" = \'done\' WHERE "job_id" = ? AND "chunk" = ?', (job_id, chunk))
+            chunks_done, chunk_count = conn.execute(
+                'UPDATE pricing_jobs SET "chunks_done" = "chunks_done" + 1 WHERE "job_id" = ? RETURNING "chunks_done", "chunk_count"',
+                (job_id,),
+            ).fetchone()
+        if chunks_done == chunk_count:
+            _finish_job(conn, job)
+    except Exception as e:
+        _fail_job(conn, job_id, chunk, f"{type(e).__name__}: {e}")
+    return True
+
+def worker_loop(db_path=DB_PATH, parent_pid=None, idle_seconds=WORKER_IDLE_SECONDS):
+    # Entry point of a pool process; exits once the process that started it is gone, or
+    # after idle_seconds without work (ensure_workers starts new ones when needed)
+    conn = connect(db_path)
+    try:
+        idle_since = time.monotonic()
+        while parent_pid is None or os.getppid() == parent_pid:
+            if run_next_chunk(conn):
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= idle_seconds:
+                return
+            else:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        conn.close()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def requeue_orphaned_chunks(conn):
+    # Chunks claimed by a worker that has since died go back on the queue
+    running = conn.execute('SELECT "job_id", "chunk", "worker_pid" FROM pricing_job_chunks WHERE "status" = \'running\'').fetchall()
+    orphaned = [(job_id, chunk) for job_id, chunk, pid in running if pid is None or not _pid_alive(pid)]
+    if orphaned:
+        with conn:
+            conn.executemany('UPDATE pricing_job_chunks SET "status" = \'queued\', "worker_pid" = NULL WHERE "job_id" = ? AND "chunk" = ?', orphaned)
+    return len(orphaned)
+
+# One pool per server process, shared by every Streamlit session
+_pool_lock = threading.Lock()
+_pool = []
+
+def ensure_workers(db_path=DB_PATH, processes=None):
+    # Starts (or restarts) the local worker processes; cheap to call on every page run
+    with _pool_lock:
+        _pool[:] = [process for process in _pool if process.is_alive()]
+        wanted = processes or default_workers()
+        if len(_pool) >= wanted:
+            return len(_pool)
+        conn = connect(db_path)
+        try:
+            requeue_orphaned_chunks(conn)
+        finally:
+            conn.close()
+        # spawn, not fork: the Streamlit server process is multi-threaded
+        context = multiprocessing.get_context("spawn")
+        while len(_pool) < wanted:
+            process = context.Process(target=worker_loop, args=(os.path.abspath(db_path), os.getpid()), daemon=True)
+            process.start()
+            _pool.append(process)
+        return len(_pool)
+
+def job_status(job_id, db_path=DB_PATH):
+    conn = connect(db_path)
+    try:
+        return _job_row(conn, job_id)
+    finally:
+        conn.close()
+
+def collect_job_result(job_id, db_path=DB_PATH):
+    # Loads a finished job's priced frame and removes its files
+    conn = connect(db_path)
+    try:
+        job = _job_row(conn, job_id)
+        if job is None or job["status"] != "done":
+            raise ValueError(f"Job {job_id} has no result to collect (status: {job['status'] if job else 'unknown'})")
+        result = pd.read_parquet(os.path.join(job["job_path"], "result.parquet"))
+        with conn:
+            conn.execute('UPDATE pricing_jobs SET "status" = \'collected\' WHERE "job_id" = ?', (job_id,))
+        shutil.rmtree(job["job_path"], ignore_errors=True)
+        return result
+    finally:
+        conn.close()
+
+def cleanup_jobs(conn, max_age_seconds=JOB_RETENTION_SECONDS):
+    # Files of jobs nobody collected are removed after a day; the job rows are kept as history
+    cutoff = datetime.fromtimestamp(time.time() - max_age_seconds).isoformat(sep=" ", timespec="seconds")
+    stale = conn.execute(
+        'SELECT "job_id", "job_path" FROM pricing_jobs WHERE "created" < ? AND "status" IN (\'done\', \'failed\')', (cutoff,),
+    ).fetchall()
+    for job_id, job_path in stale:
+        if job_path:
+            shutil.rmtree(job_path, ignore_errors=True)
+    if stale:
+        with conn:
+            conn.executemany('UPDATE pricing_jobs SET "status" = \'expired\' WHERE "job_id" = ?', [(job_id,) for job_id, _ in stale])
@@ -1,6 +1,202 @@
-def main():
-    print("Hello from pricing-engine!")
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from instrumentation import PipelineMetrics, write_metrics
+from markup_index import GAP_POLICIES
+from rules import DB_PATH, load_pricing_rules
+from snapshots import SNAPSHOT_DIR, compile_snapshot, list_snapshots, load_snapshot, snapshot_path
+from export import CSV_COMPRESSIONS, EXPORT_FORMATS, PARQUET_COMPRESSIONS, export_suffix
+from freight import FREIGHT_STRATEGIES, freight_strategy
+from streaming import DEFAULT_CHUNK_SIZE, price_file_to_export
+
+# Live pricing rules are loaded once in the parent and handed to each worker at startup;
+# with a snapshot, each worker reads the snapshot file itself
+_worker_rules = None
+
+def _init_worker(markup_data, category_multipliers, snapshot=None, snapshot_dir=SNAPSHOT_DIR):
+    global _worker_rules
+    if snapshot is not None:
+        rules = load_snapshot(snapshot, snapshot_dir)
+        markup_data, category_multipliers, snapshot = rules.markup_data, rules.category_multipliers, rules.snapshot
+    _worker_rules = (markup_data, category_multipliers, snapshot)
+
+def _price_one(source, output, freight_cost, currency, exchange_rate, chunk_size, on_gap, track_memory, fmt="csv", compression=None, freight=None):
+    markup_data, category_multipliers, snapshot = _worker_rules
+    default_category = next(iter(category_multipliers), "")
+    metrics = PipelineMetrics(track_memory=track_memory, source="cli", file=source, rules_snapshot=snapshot)
+    start = time.perf_counter()
+    rows = price_file_to_export(source, output, freight_cost, currency, exchange_rate, markup_data, category_multipliers,
+                                chunk_size=chunk_size, default_category=default_category, on_gap=on_gap,
+                                fmt=fmt, compression=compression, metrics=metrics, freight=freight)
+    return rows, time.perf_counter() - start, metrics.records()
+
+def _expand_inputs(patterns):
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        files.extend(matches if matches else [pattern])
+    return files
+
+def _output_paths(files, output_dir, suffix=".csv"):
+    stems = [os.path.splitext(os.path.basename(source))[0] for source in files]
+    outputs = {}
+    for source, stem in zip(files, stems):
+        if stems.count(stem) > 1:
+            # Keep same-named inputs (in.csv, in.xlsx, a/in.csv) from overwriting each other
+            stem = f"{stem}_{stems[:len(outputs)].count(stem) + 1}"
+        outputs[source] = os.path.join(output_dir, f"{stem}_priced{suffix}")
+    return outputs
+
+def _freight_from_args(args):
+    if args.freight_mode == "weight":
+        return freight_strategy("weight", column=args.weight_column)
+    if args.freight_mode == "per_line":
+        return freight_strategy("per_line", amount=args.freight_rate)
+    if args.freight_mode == "percentage":
+        return freight_strategy("percentage", pct=args.freight_rate)
+    if args.freight_mode == "category":
+        rates = {}
+        for item in args.category_freight:
+            category, _, pct = item.rpartition("=")
+            try:
+                rates[category] = float(pct)
+            except ValueError:
+                raise ValueError(f"--category-freight expects CATEGORY=PCT, got {item!r}") from None
+        return freight_strategy("category", rates=rates, default_pct=args.freight_rate)
+    return None
+
+def price_command(args):
+    try:
+        freight = _freight_from_args(args)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    files = list(dict.fromkeys(_expand_inputs(args.inputs)))
+    missing = [f for f in files if not os.path.isfile(f)]
+    if missing:
+        print(f"Input file(s) not found: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    allowed = CSV_COMPRESSIONS if args.format == "csv" else PARQUET_COMPRESSIONS if args.format == "parquet" else []
+    if args.compression and args.compression not in allowed:
+        print(f"{args.format} output does not support {args.compression} compression", file=sys.stderr)
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = _output_paths(files, args.output_dir, export_suffix(args.format, args.compression))
+
+    if args.snapshot:
+        try:
+            snapshot = snapshot_path(args.snapshot, args.snapshot_dir)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        if not os.path.isfile(snapshot):
+            print(f"Snapshot not found: {snapshot}", file=sys.stderr)
+            return 1
+        initargs = (None, None, args.snapshot, args.snapshot_dir)
+        print(f"Pricing against rule snapshot {args.snapshot}")
+    else:
+        # connect() would create a new, empty database at a mistyped path
+        if not os.path.isfile(args.db):
+            print(f"Pricing rules database not found: {args.db}", file=sys.stderr)
+            return 1
+        try:
+            initargs = load_pricing_rules(args.db)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+    workers = args.workers or os.cpu_count() or 1
+    total_rows = 0
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)), initializer=_init_worker,
+                             initargs=initargs) as pool:
+        futures = {
+            pool.submit(_price_one, source, outputs[source], args.freight, args.currency,
+                        args.rate, args.chunk_size, args.on_gap, args.track_memory, args.format, args.compression, freight): source
+            for source in files
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                rows, elapsed, records = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"{source}: FAILED ({e})", file=sys.stderr)
+                continue
+            total_rows += rows
+            if args.metrics:
+                write_metrics(args.metrics, records)
+            rate = rows / elapsed if elapsed > 0 else float("inf")
+            print(f"{source}: {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/s) -> {outputs[source]}")
+
+    elapsed = time.perf_counter() - start
+    rate = total_rows / elapsed if elapsed > 0 else float("inf")
+    print(f"Priced {len(files) - failures}/{len(files)} file(s), {total_rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    return 1 if failures else 0
+
+def snapshot_command(args):
+    if args.list:
+        for name in list_snapshots(args.snapshot_dir):
+            print(name)
+        return 0
+    try:
+        name = compile_snapshot(args.db, args.name, args.snapshot_dir)
+    except (FileExistsError, ValueError) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"Snapshot {name} -> {snapshot_path(name, args.snapshot_dir)}")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pricing-engine", description="Headless pricing engine.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    price = subparsers.add_parser("price", help="Price one or more purchase files (CSV or Excel).")
+    price.add_argument("inputs", nargs="+", help="Input files or glob patterns.")
+    price.add_argument("-o", "--output-dir", default=".", help="Directory for the priced files.")
+    price.add_argument("--format", default="csv", choices=EXPORT_FORMATS, help="Output file format.")
+    price.add_argument("--compression", default=None, choices=sorted({*CSV_COMPRESSIONS, *PARQUET_COMPRESSIONS}),
+                       help="CSV: gzip, bz2 or xz. Parquet: snappy, zstd or gzip.")
+    price.add_argument("--currency", default="USD", choices=["USD", "AUD"])
+    price.add_argument("--rate", type=float, default=1.0, help="Exchange rate (if not AUD).")
+    price.add_argument("--freight", type=float, default=0.0, help="Total freight cost (AUD) per file.")
+    price.add_argument("--freight-mode", default="value", choices=list(FREIGHT_STRATEGIES),
+                       help="How freight is allocated to lines (default: by purchase value).")
+    price.add_argument("--weight-column", default="Weight", help="Per-unit weight column for --freight-mode weight.")
+    price.add_argument("--freight-rate", type=float, default=0.0,
+                       help="AUD per line (per_line), percent of purchase cost (percentage), or default percent (category).")
+    price.add_argument("--category-freight", action="append", default=[], metavar="CATEGORY=PCT",
+                       help="Freight percent of purchase cost for one category (category mode; repeatable).")
+    price.add_argument("--db", default=DB_PATH, help="Path to the pricing rules database.")
+    price.add_argument("--snapshot", default=None, help="Price against this rule snapshot instead of the live rules.")
+    price.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="Directory holding rule snapshots.")
+    price.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    price.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows priced per chunk.")
+    price.add_argument("--on-gap", default="lower", choices=GAP_POLICIES, help="Markup for costs between bands.")
+    price.add_argument("--metrics", default=None, help="Append per-stage timings for each file to this JSON Lines file.")
+    price.add_argument("--track-memory", action="store_true", help="Also record allocation per stage (slower).")
+    price.set_defaults(func=price_command)
+
+    snapshot = subparsers.add_parser("snapshot", help="Compile the live pricing rules into an immutable snapshot file.")
+    snapshot.add_argument("--name", default=None, help="Snapshot name (default: rules-v<version>-<hash>).")
+    snapshot.add_argument("--db", default=DB_PATH, help="Path to the pricing rules database.")
+    snapshot.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="Directory holding rule snapshots.")
+    snapshot.add_argument("--list", action="store_true", help="List existing snapshots, newest first.")
+    snapshot.set_defaults(func=snapshot_command)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not hasattr(args, "func"):
+        parser.print_help()
+        return 0
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
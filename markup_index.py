@@ -0,0 +1,121 @@
+import numpy as np
+
+GAP_POLICIES = ("lower", "nearest", "flag")
+DEFAULT_MARKUP = 1.0
+
+class MarkupIndex:
+    # Bands are closed intervals [From, To]. Where bands overlap, the first band in
+    # table order wins, as it did with the old row-by-row filter. Every distinct edge
+    # is kept as a breakpoint, and each breakpoint and each open interval between two
+    # breakpoints is resolved to a band once at compile time, so a lookup is a single
+    # searchsorted over the whole cost column.
+
+    def __init__(self, lower, upper, markups, on_gap="lower", default_markup=DEFAULT_MARKUP):
+        if on_gap not in GAP_POLICIES:
+            raise ValueError(f"on_gap must be one of {GAP_POLICIES}, got {on_gap!r}")
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.markups = np.asarray(markups, dtype=float)
+        self.on_gap = on_gap
+        self.default_markup = float(default_markup)
+        self.breakpoints = np.unique(np.concatenate([self.lower, self.upper]))
+        self.segment_bands = self._resolve_segments()
+        self.has_overlaps = self._has_overlaps()
+
+    @classmethod
+    def from_table(cls, edited_markup, on_gap="lower", default_markup=DEFAULT_MARKUP):
+        table = edited_markup.dropna(subset=["From", "To", "RRPP Markup"])
+        return cls(table["From"], table["To"], table["RRPP Markup"], on_gap, default_markup)
+
+    def _first_band_containing(self, value):
+        hits = np.flatnonzero((self.lower <= value) & (value <= self.upper))
+        return hits[0] if len(hits) else -1
+
+    def _resolve_segments(self):
+        # Segment 2i is the open interval just below breakpoint i (segment 0 lies below
+        # the table and segment 2k above it); segment 2i + 1 is breakpoint i itself.
+        points = self.breakpoints
+        bands = np.full(2 * len(points) + 1, -1, dtype=np.int16)
+        for i, point in enumerate(points):
+            bands[2 * i + 1] = self._first_band_containing(point)
+            if i > 0:
+                bands[2 * i] = self._first_band_containing((points[i - 1] + point) / 2)
+        return bands
+
+    def _has_overlaps(self):
+        order = np.argsort(self.lower, kind="stable")
+        return bool(np.any(self.lower[order][1:] <= np.maximum.accumulate(self.upper[order])[:-1]))
+
+    def _segments(self, costs):
+        positions = np.searchsorted(self.breakpoints, costs, side="left")
+        exact = positions < len(self.breakpoints)
+        exact[exact] = self.breakpoints[positions[exact]] == costs[exact]
+        return 2 * positions + exact
+
+    def band_codes(self, costs):
+        # Index of the matching band in table order, or -1 where no band contains the cost
+        costs = np.asarray(costs, dtype=float)
+        return self.segment_bands[self._segments(costs)]
+
+    def gap_mask(self, costs, codes=None):
+        # Costs that fall between two bands, as opposed to below or above the whole table
+        costs = np.asarray(costs, dtype=float)
+        if codes is None:
+            codes = self.band_codes(costs)
+        if len(self.breakpoints) == 0:
+            return np.zeros(len(costs), dtype=bool)
+        return (codes < 0) & (costs > self.breakpoints[0]) & (costs < self.breakpoints[-1])
+
+    def resolved_codes(self, costs):
+        costs = np.asarray(costs, dtype=float)
+        codes = self.band_codes(costs)
+        if self.on_gap == "flag" or len(self.markups) == 0:
+            return codes
+        gaps = self.gap_mask(costs, codes)
+        if not gaps.any():
+            return codes
+        gap_costs = costs[gaps]
+        # A cost in a gap always has a band ending below it and a band starting above it
+        by_upper = np.argsort(self.upper, kind="stable")
+        sorted_upper = self.upper[by_upper]
+        nearest_upper = sorted_upper[np.searchsorted(sorted_upper, gap_costs, side="left") - 1]
+        chosen = by_upper[np.searchsorted(sorted_upper, nearest_upper, side="left")]
+        if self.on_gap == "nearest":
+            by_lower = np.argsort(self.lower, kind="stable")
+            sorted_lower = self.lower[by_lower]
+            above = by_lower[np.searchsorted(sorted_lower, gap_costs, side="right")]
+            chosen = np.where(self.lower[above] - gap_costs < gap_costs - nearest_upper, above, chosen)
+        codes = codes.copy()
+        codes[gaps] = chosen
+        return codes
+
+    def markups_for(self, codes):
+        codes = np.asarray(codes)
+        if len(self.markups) == 0:
+            return np.full(len(codes), self.default_markup)
+        return np.where(codes >= 0, self.markups[np.maximum(codes, 0)], self.default_markup)
+
+    def lookup(self, costs):
+        return self.markups_for(self.resolved_codes(costs))
+
+    def scaled(self, factor):
+        # Same bands with every markup multiplied by factor, as a price increase on the
+        # markup table does; rows outside the table keep the default markup
+        return MarkupIndex(self.lower, self.upper, self.markups * factor, self.on_gap, self.default_markup)
+
+    def code_dtype(self):
+        # Smallest integer type that holds every band code plus -1 for "no band"
+        return np.int8 if len(self.markups) < np.iinfo(np.int8).max else np.int16
+
+_index_cache = {}
+
+def get_markup_index(edited_markup, on_gap="lower", default_markup=DEFAULT_MARKUP):
+    if isinstance(edited_markup, MarkupIndex):
+        return edited_markup
+    table = edited_markup[["From", "To", "RRPP Markup"]].to_numpy(dtype=float)
+    key = (table.shape, table.tobytes(), on_gap, float(default_markup))
+    if key not in _index_cache:
+        if len(_index_cache) >= 32:
+            _index_cache.clear()
+        _index_cache[key] = MarkupIndex.from_table(edited_markup, on_gap, default_markup)
+    return _index_cache[key]
@@ -1,18 +1,22 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+from frame_view import frame_view_controls, view_summary
+from ingestion import invalid_category_mask, load_purchase_files
+from rules import get_pricing_rules
 
 st.set_page_config(page_title="Upload and Validate", layout="wide", page_icon="favicon.png")
 
 st.title("Upload and Validate Data")
 
-# Connect to the database and get valid categories once
-conn = sqlite3.connect("pricing_engine.db")
-category_multipliers_df = pd.read_sql("SELECT * FROM category_multipliers", conn)
-valid_categories = category_multipliers_df["Category"].tolist()
+# Valid categories come from the shared rule cache, which reloads only when the rules change
+try:
+    valid_categories = get_pricing_rules().valid_categories
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
 
 # File Upload
-uploaded_file = st.file_uploader("Upload purchase file (Excel or CSV)", type=[".xlsx", ".xls", ".csv"])
+uploaded_files = st.file_uploader("Upload purchase files (Excel or CSV)", type=[".xlsx", ".xls", ".csv"], accept_multiple_files=True)
 
 # Download template
 @st.cache_data
@@ -32,45 +36,74 @@ st.download_button(
     mime="text/csv",
 )
 
-# Process file if it exists
-if uploaded_file:
-    if st.session_state.get('uploaded_file_name') != uploaded_file.name:
+# Process files if there are any; they are parsed and validated together, once per selection
+if uploaded_files:
+    upload_key = tuple((f.name, f.size) for f in uploaded_files)
+    if st.session_state.get('upload_key') != upload_key:
         st.session_state.clear()
         st.session_state.currency = "USD"
         st.session_state.exchange_rate = 1.0
         st.session_state.freight_cost = 0.0
         st.session_state.freight_mode = "Auto"
 
-        if uploaded_file.name.endswith('.csv'):
-            st.session_state.df = pd.read_csv(uploaded_file)
-        else:
-            st.session_state.df = pd.read_excel(uploaded_file)
-        
-        st.session_state.df.columns = st.session_state.df.columns.str.strip()
-        for col in st.session_state.df.columns:
-            if st.session_state.df[col].dtype == 'object':
-                st.session_state.df[col] = st.session_state.df[col].str.strip()
-        
-        st.session_state.df['Purchase Cost'] = st.session_state.df['Purchase Cost'].replace({'[^0-9.]': ''}, regex=True).astype(float)
-        st.session_state.df['Qty'] = pd.to_numeric(st.session_state.df['Qty'], errors='coerce').fillna(0).astype(int)
-
         default_category = valid_categories[0] if valid_categories else ""
-        if 'Category' not in st.session_state.df.columns:
-            st.session_state.df['Category'] = default_category
-        
-        st.session_state.df['Category'] = st.session_state.df['Category'].fillna(default_category).astype(str)
-        st.session_state.df['Category'] = st.session_state.df['Category'].replace("", default_category)
+        with st.spinner(f"Reading {len(uploaded_files)} file(s)..."):
+            df, invalid_rows, file_summaries = load_purchase_files(uploaded_files, default_category=default_category, categories=valid_categories)
+        if df is not None:
+            st.session_state.df = df
+            st.session_state.invalid_rows = invalid_rows
+        st.session_state.file_summaries = file_summaries
 
-        st.session_state.uploaded_file_name = uploaded_file.name
+        st.session_state.upload_key = upload_key
+        st.session_state.uploaded_file_name = ", ".join(f.name for f in uploaded_files)
         st.rerun()
 
+if 'file_summaries' in st.session_state:
+    file_summaries = st.session_state.file_summaries
+    if len(file_summaries) > 1:
+        st.subheader("Files")
+        st.dataframe(file_summaries, hide_index=True, use_container_width=True)
+    for _, failed in file_summaries[file_summaries["Error"] != ""].iterrows():
+        st.error(f"{failed['File']} could not be read: {failed['Error']}")
+
+def current_invalid_rows():
+    # The mask comes with the uploaded files; it is rebuilt for sessions that have a frame
+    # without one (set elsewhere, or from before the mask existed)
+    df = st.session_state.df
+    invalid_rows = st.session_state.get('invalid_rows')
+    if invalid_rows is None or not invalid_rows.index.equals(df.index):
+        invalid_rows = invalid_category_mask(df["Category"], valid_categories)
+        st.session_state.invalid_rows = invalid_rows
+    return invalid_rows
+
+def apply_page_edits(editor_key, page_index):
+    # Writes the visible page's edits back into the session frame as they are made, and
+    # starts a fresh editor so its pending edits never apply to a different page
+    df = st.session_state.df
+    edited_rows = st.session_state[editor_key]["edited_rows"]
+    for position, changes in edited_rows.items():
+        for col, value in changes.items():
+            df.at[page_index[position], col] = value
+    rows = page_index[list(edited_rows)]
+    current_invalid_rows().loc[rows] = invalid_category_mask(df.loc[rows, "Category"], valid_categories)
+    st.session_state.editor_version = st.session_state.get('editor_version', 0) + 1
+
 # Display and validation logic if df exists in state
 if 'df' in st.session_state:
     st.subheader("Edit Data and Categories")
-    st.info("Edit the categories below and click 'Apply Changes' to save them to the current session.")
+    st.info("Edit the categories below; changes are saved to the current session as you make them. "
+            "Only the current page is sent to the browser, so filter to the rows you need.")
 
-    edited_df = st.data_editor(
-        st.session_state.df,
+    editor_version = st.session_state.get('editor_version', 0)
+    positions, page_df = frame_view_controls(
+        st.session_state.df, "upload_view",
+        row_filters={"Invalid categories only": current_invalid_rows().to_numpy(),
+                     "Missing purchase cost only": st.session_state.df["Purchase Cost"].isna().to_numpy()},
+        version=editor_version,
+    )
+    editor_key = f"data_editor_{editor_version}"
+    st.data_editor(
+        page_df,
         column_config={
             "Category": st.column_config.SelectboxColumn(
                 "Category",
@@ -79,14 +112,20 @@ if 'df' in st.session_state:
             )
         },
         use_container_width=True,
-        key="data_editor"
+        key=editor_key,
+        on_change=apply_page_edits,
+        args=(editor_key, page_df.index),
     )
 
-    if st.button("Apply Changes"):
-        st.session_state.df = edited_df
-        st.success("Changes have been applied successfully!")
-        st.rerun()
+    totals, _ = view_summary("upload_view")
+    st.caption(f"Filtered rows: {len(positions):,}; total quantity {totals['Qty']:,.0f}; purchase value {totals['Purchase Cost Total']:,.2f}.")
+
+    # Precomputed when the files were read and updated only for edited rows, not on every rerun
+    invalid_count = int(current_invalid_rows().sum())
+    if invalid_count:
+        st.warning(f"{invalid_count} row(s) still have invalid categories. Please correct them before proceeding.")
 
-    mismatched_categories = st.session_state.df[~st.session_state.df["Category"].isin(valid_categories)]
-    if not mismatched_categories.empty:
-        st.warning("Some rows still have invalid categories. Please correct them before proceeding.")
\ No newline at end of file
+    missing_costs = int(st.session_state.df["Purchase Cost"].isna().sum())
+    if missing_costs:
+        st.warning(f"{missing_costs} row(s) have a missing or unreadable Purchase Cost. Please correct them before proceeding; "
+                   "pricing is blocked until every row has a cost.")
@@ -1,8 +1,19 @@
+import hashlib
+import os
 import streamlit as st
 import pandas as pd
-import sqlite3
 from datetime import datetime
-from calculations import calculate_landed_cost, calculate_rrpp, calculate_tiered_pricing
+from calculations import calculate_pricing, expand_priced_frame, reprice_changed_rows
+from rules import get_pricing_rules
+from storage import connect, save_priced_parts
+from history import DEFAULT_THRESHOLD_PCT, price_delta_report
+from scenarios import price_scenario, scenario_grid, sweep_scenarios
+from snapshots import list_snapshots, load_snapshot
+from instrumentation import PipelineMetrics
+from frame_view import frame_view_controls, view_summary
+from export import export_mime, export_suffix, export_to_tempfile, frame_chunks
+from freight import bind_freight, freight_spec, freight_strategy
+from jobs import ACTIVE_STATUSES, collect_job_result, ensure_workers, job_status, submit_job
 
 st.set_page_config(page_title="Calculate and Export", layout="wide", page_icon="favicon.png")
 
@@ -53,12 +64,14 @@ else:
             key="freight_cost_input_widget", # Use a distinct key for the widget
             on_change=update_freight_cost
         )
+    # Freight Mode label -> freight allocation strategy (freight.py); "Auto" shares the freight cost by purchase value
+    FREIGHT_MODES = {"Auto": "value", "By weight": "weight", "Fixed per line": "per_line", "Percentage of cost": "percentage", "Per category": "category"}
     with col4:
         st.selectbox(
             "Freight Mode",
-            options=["Auto", "Manual"],
+            options=list(FREIGHT_MODES),
             key="freight_mode_input_widget", # Use a distinct key for the widget
-            index=["Auto", "Manual"].index(st.session_state.freight_mode),
+            index=list(FREIGHT_MODES).index(st.session_state.freight_mode) if st.session_state.freight_mode in FREIGHT_MODES else 0,
             on_change=update_freight_mode
         )
 
@@ -66,50 +79,161 @@ else:
     currency = st.session_state.currency
     exchange_rate = st.session_state.exchange_rate
     freight_cost = st.session_state.freight_cost
-    freight_mode = st.session_state.freight_mode
+    freight_mode = st.session_state.freight_mode if st.session_state.freight_mode in FREIGHT_MODES else "Auto"
 
-    if freight_mode == "Manual":
-        st.warning("Manual freight mode selected. Please ensure freight rate is added as a percentage elsewhere.")
+    # Strategy parameters; weight totals are bound to the invoice when pricing starts
+    freight_params = {}
+    if freight_mode == "By weight":
+        extra_columns = [col for col in st.session_state.df.columns if col not in ("Qty", "Inv #", "Part Number", "Purchase Cost", "Category")]
+        if extra_columns:
+            freight_params["column"] = st.selectbox("Weight column (per unit)", options=extra_columns,
+                                                    index=extra_columns.index("Weight") if "Weight" in extra_columns else 0, key="freight_weight_column")
+            st.caption("The total freight cost is shared in proportion to each line's quantity times its weight.")
+        else:
+            st.warning("The uploaded file has no weight column. Add a per-unit weight column (for example 'Weight') to use this mode.")
+    elif freight_mode == "Fixed per line":
+        freight_params["amount"] = st.number_input("Freight per invoice line (AUD)", min_value=0.0, value=0.0, step=1.0, key="freight_line_amount")
+        st.caption("Each line carries this amount, spread over its quantity. The total freight cost above is not used.")
+    elif freight_mode == "Percentage of cost":
+        freight_params["pct"] = st.number_input("Freight (% of purchase cost)", min_value=0.0, value=0.0, step=0.5, key="freight_pct")
+        st.caption("Each unit carries this percentage of its AUD purchase cost. The total freight cost above is not used.")
+    elif freight_mode == "Per category":
+        invoice_categories = st.session_state.df["Category"].astype("category").cat.categories.tolist()
+        # The editor keeps its edits by row position, so its key changes with the category list;
+        # otherwise rates typed for one upload would land on another upload's categories
+        rates_key = "freight_category_rates_" + hashlib.blake2b("\n".join(map(str, invoice_categories)).encode(), digest_size=8).hexdigest()
+        rates_df = st.data_editor(pd.DataFrame({"Category": invoice_categories, "Freight %": 0.0}), disabled=["Category"],
+                                  hide_index=True, key=rates_key)
+        freight_params["rates"] = dict(zip(rates_df["Category"], rates_df["Freight %"].fillna(0.0)))
+        st.caption("Each unit carries its category's percentage of its AUD purchase cost. The total freight cost above is not used.")
+    freight = freight_strategy(FREIGHT_MODES[freight_mode], **freight_params)
 
-    conn = sqlite3.connect("pricing_engine.db")
-    markup_data = pd.read_sql("SELECT * FROM rrpp_markup_table", conn)
-    category_multipliers_df = pd.read_sql("SELECT * FROM category_multipliers", conn)
-    category_multipliers = pd.Series(category_multipliers_df.Multiplier.values,index=category_multipliers_df.Category).to_dict()
+    LIVE_RULES = "Live rules"
+    rules_source = st.selectbox("Pricing Rules", options=[LIVE_RULES] + list_snapshots(), key="rules_snapshot",
+                                help="Price against the live rule tables or a compiled rule snapshot.")
+
+    metrics = PipelineMetrics(track_memory=st.session_state.get('track_memory_allocation', False), source="app")
+    try:
+        with metrics.stage("load_rules"):
+            pricing_rules = get_pricing_rules() if rules_source == LIVE_RULES else load_snapshot(rules_source)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    markup_index = pricing_rules.markup_index
+    category_multipliers = pricing_rules.category_multipliers
+
+    # Everything a result is priced with, kept with it in the session. Save and Download
+    # records the run from it and restores the full columns with its rules, so widget or
+    # rule changes made after pricing cannot leak into the saved run.
+    def pricing_run(total_purchase, invoice_freight, rules):
+        return {"total_purchase": total_purchase, "freight_cost": freight_cost, "currency": currency,
+                "exchange_rate": exchange_rate, "freight": invoice_freight, "rules": rules}
+
+    def pricing_key(run):
+        return (run["total_purchase"], run["freight_cost"], run["currency"], run["exchange_rate"],
+                run["rules"].version, run["rules"].snapshot, run["freight"])
 
     def perform_calculations(df_to_calculate):
-        df_calculated = df_to_calculate.copy()
-        df_calculated['Purchase Cost'] = df_calculated['Purchase Cost'].replace('[\$,]', '', regex=True).astype(float)
-        df_calculated['Qty'] = df_calculated['Qty'].astype(float)
+        with metrics.stage("copy_frame", len(df_to_calculate)):
+            df_calculated = df_to_calculate.copy()
+            df_calculated['Purchase Cost'] = df_calculated['Purchase Cost'].astype(float)
 
-        total_purchase = (df_calculated['Qty'] * df_calculated['Purchase Cost']).sum()
+        total_purchase = (df_calculated['Qty'].astype(float) * df_calculated['Purchase Cost']).sum()
+        invoice_freight = bind_freight(freight, df_calculated)
 
-        df_calculated = calculate_landed_cost(df_calculated, total_purchase, freight_cost, currency, exchange_rate)
-        df_calculated = calculate_rrpp(df_calculated, markup_data, category_multipliers)
-        df_calculated = calculate_tiered_pricing(df_calculated)
+        # Reprice only edited rows when nothing else that feeds the calculation has changed
+        run = pricing_run(total_purchase, invoice_freight, pricing_rules)
+        previous = st.session_state.get('calculated_df')
+        previous_run = st.session_state.get('calculated_run')
+        if previous is not None and previous_run is not None and pricing_key(previous_run) == pricing_key(run) and previous.index.equals(df_calculated.index):
+            with metrics.stage("incremental_reprice", len(df_calculated)):
+                df_calculated, repriced_rows = reprice_changed_rows(df_calculated, previous, total_purchase, freight_cost, currency, exchange_rate, markup_index, category_multipliers, freight=invoice_freight)
+            st.info(f"{repriced_rows} changed row(s) repriced.")
+        else:
+            df_calculated = calculate_pricing(df_calculated, total_purchase, freight_cost, currency, exchange_rate, markup_index, category_multipliers, metrics=metrics, compact=True, freight=invoice_freight)
+        st.session_state.calculated_run = run
 
-        st.success("Landed Cost, RRPP, and Tiers calculated successfully.")
-        st.dataframe(df_calculated)
+        show_results(df_calculated)
         return df_calculated
 
+    def show_results(df_calculated):
+        unmatched_rows = int((df_calculated['Markup Band'] < 0).sum())
+        if unmatched_rows:
+            st.warning(f"{unmatched_rows} row(s) have a landed cost outside the RRPP markup table; a markup of 1.0 was applied.")
+
+        st.success("Landed Cost, RRPP, and Tiers calculated successfully.")
+
+    def submit_background_job(df_to_calculate):
+        total_purchase = (df_to_calculate['Qty'].astype(float) * df_to_calculate['Purchase Cost'].astype(float)).sum()
+        invoice_freight = bind_freight(freight, df_to_calculate)
+        ensure_workers()
+        job_id = submit_job(df_to_calculate, freight_cost, currency, exchange_rate, total_purchase=total_purchase,
+                            rules_snapshot=pricing_rules.snapshot, source=st.session_state.get('uploaded_file_name'), freight=invoice_freight)
+        # The job prices against a snapshot (compiled from the live rules if none was chosen),
+        # which replaces rules in the run once the job is collected
+        st.session_state.pricing_job = {"job_id": job_id, "run": pricing_run(total_purchase, invoice_freight, pricing_rules)}
+
+    run_in_background = st.checkbox("Run in the background worker pool", key="run_in_background",
+                                     help="Prices the file in row chunks across all CPU cores without blocking this page. Recommended for large files.")
+
+    DOWNLOAD_FORMATS = {"CSV": ("csv", None), "CSV (gzip)": ("csv", "gzip"), "Parquet": ("parquet", "zstd"), "Excel (.xlsx)": ("xlsx", None)}
+    download_format = st.selectbox("Download format", options=list(DOWNLOAD_FORMATS), key="download_format")
+
+    # Set when this run priced in the foreground; its metrics are kept once the result is rendered
+    calculated_now = False
     col_calc1, col_calc2, col_calc3 = st.columns(3)
     with col_calc1:
         if st.button("Calculate Pricing"):
-            try:
-                st.session_state.calculated_df = perform_calculations(st.session_state.df)
-            except Exception as e:
-                st.error(f"An error occurred during recalculation: {e}")
+            # Rows without a cost would price as NaN, so they are fixed on the upload page first
+            missing_costs = int(st.session_state.df['Purchase Cost'].isna().sum())
+            if missing_costs:
+                st.error(f"{missing_costs} row(s) have a missing or unreadable Purchase Cost. Please correct them on the 'Upload and Validate' page first.")
+            elif run_in_background:
+                try:
+                    submit_background_job(st.session_state.df)
+                except Exception as e:
+                    st.error(f"An error occurred while submitting the background job: {e}")
+            else:
+                try:
+                    st.session_state.calculated_df = perform_calculations(st.session_state.df)
+                    calculated_now = True
+                except Exception as e:
+                    st.error(f"An error occurred during recalculation: {e}")
 
     with col_calc2:
         if st.button("Save and Download"):
             try:
-                if 'calculated_df' in st.session_state:
-                    st.session_state.calculated_df["timestamp"] = datetime.now()
-                    st.session_state.calculated_df.to_sql("priced_parts", conn, if_exists="append", index=False)
+                calculated_run = st.session_state.get('calculated_run')
+                if 'calculated_df' in st.session_state and calculated_run is None:
+                    st.warning("This result has no record of the parameters it was priced with. Please calculate pricing again before saving.")
+                elif 'calculated_df' in st.session_state and st.session_state.calculated_df['RRPP'].isna().any():
+                    st.warning("Some rows of this result have no price. Please correct their Purchase Cost and calculate pricing again before saving.")
+                elif 'calculated_df' in st.session_state:
+                    timestamp = datetime.now()
+                    priced_rules = calculated_run["rules"]
+                    # The session keeps the compact frame; full columns exist only for the export
+                    export_df = expand_priced_frame(st.session_state.calculated_df, priced_rules.markup_index, priced_rules.category_multipliers)
+                    conn = connect()
+                    save_priced_parts(
+                        conn,
+                        export_df,
+                        timestamp=timestamp,
+                        currency=calculated_run["currency"],
+                        exchange_rate=calculated_run["exchange_rate"],
+                        freight_cost=calculated_run["freight_cost"],
+                        rules_version=priced_rules.version,
+                        source=st.session_state.get('uploaded_file_name'),
+                        rules_snapshot=priced_rules.snapshot,
+                        freight_allocation=freight_spec(calculated_run["freight"]),
+                    )
                     conn.close()
                     
-                    st.session_state.download_csv_data = st.session_state.calculated_df.drop(columns=["timestamp", "RRPP Markup", "Category Multiplier"], errors='ignore').to_csv(index=False)
-                    st.session_state.download_file_name = "priced_parts.csv"
-                    st.session_state.download_mime_type = "text/csv"
+                    # Written to a temp file in chunks; the session only keeps its path
+                    fmt, compression = DOWNLOAD_FORMATS[download_format]
+                    download_path, _ = export_to_tempfile(frame_chunks(export_df), fmt, compression)
+                    st.session_state.download_path = download_path
+                    st.session_state.download_file_name = "priced_parts" + export_suffix(fmt, compression)
+                    st.session_state.download_mime_type = export_mime(fmt, compression)
 
                     st.success("Pricing data saved. Initiating download and restarting...")
                     st.rerun()
@@ -127,14 +251,146 @@ else:
             st.session_state.freight_mode = "Auto"
             st.rerun()
 
-    if 'download_csv_data' in st.session_state and st.session_state.download_csv_data:
-        st.download_button(
-            label="Click here to download",
-            data=st.session_state.download_csv_data,
-            file_name=st.session_state.download_file_name,
-            mime=st.session_state.download_mime_type,
-            key="final_download_button"
-        )
-        del st.session_state.download_csv_data
+    if 'pricing_job' in st.session_state:
+        pricing_job = st.session_state.pricing_job
+        job = job_status(pricing_job["job_id"])
+        if job is None or job["status"] not in ACTIVE_STATUSES + ("done",):
+            del st.session_state.pricing_job
+            st.error(f"Background job {pricing_job['job_id']} failed: {(job['error'] or job['status']) if job else 'job not found'}")
+        elif job["status"] == "done":
+            del st.session_state.pricing_job
+            try:
+                st.session_state.calculated_df = collect_job_result(pricing_job["job_id"])
+                st.session_state.calculated_run = {**pricing_job["run"], "rules": load_snapshot(job["rules_snapshot"])}
+                st.info(f"Background job {pricing_job['job_id']} priced {job['row_count']} row(s) in {job['chunk_count']} chunk(s) using rule snapshot {job['rules_snapshot']}.")
+                show_results(st.session_state.calculated_df)
+            except Exception as e:
+                st.error(f"An error occurred while collecting the background job: {e}")
+        else:
+            # Polls the queue every second without rerunning the rest of the page
+            @st.fragment(run_every=1.0)
+            def show_job_progress():
+                # Workers exit when idle, so any that stopped before the job was queued are replaced
+                ensure_workers()
+                current = job_status(pricing_job["job_id"])
+                if current is None or current["status"] not in ACTIVE_STATUSES:
+                    st.rerun()
+                st.progress(current["chunks_done"] / current["chunk_count"],
+                            text=f"Background job {pricing_job['job_id']} {current['status']}: {current['chunks_done']} of {current['chunk_count']} chunk(s) priced")
+            show_job_progress()
+
+    if 'calculated_df' in st.session_state:
+        calculated_df = st.session_state.calculated_df
+        # A price report is only used while it still describes the current result
+        price_report = st.session_state.get('price_report')
+        if price_report is not None and price_report["source"] is not calculated_df:
+            price_report = None
+
+        st.subheader("Priced Rows")
+        row_filters = {
+            "Outside the markup table only": (calculated_df["Markup Band"] < 0).to_numpy(),
+            "Missing purchase cost only": calculated_df["Purchase Cost"].isna().to_numpy(),
+        }
+        if price_report is not None:
+            row_filters[f"Price changed by more than {price_report['threshold']}% only"] = price_report["report"]["Flagged"].to_numpy()
+        with metrics.stage("render", len(calculated_df)):
+            positions, page_df = frame_view_controls(calculated_df, "priced_view", row_filters,
+                                                     version=id(price_report["report"]) if price_report is not None else None)
+            st.dataframe(page_df)
+        if calculated_now:
+            # Kept after rendering so the render stage is part of the recorded metrics
+            st.session_state.calculation_metrics = metrics.records()
+            metrics.log()
+            if os.environ.get("PRICING_ENGINE_METRICS_FILE"):
+                try:
+                    metrics.write(os.environ["PRICING_ENGINE_METRICS_FILE"])
+                except OSError as e:
+                    st.error(f"An error occurred while writing the metrics file: {e}")
+        totals, by_category = view_summary("priced_view")
+        margin = (1 - totals["Landed Cost AUD Total"] / totals["RRPP Total"]) * 100 if totals["RRPP Total"] else float("nan")
+        st.caption(f"Filtered rows: {len(positions):,}; quantity {totals['Qty']:,.0f}; landed cost {totals['Landed Cost AUD Total']:,.2f}; "
+                   f"RRPP {totals['RRPP Total']:,.2f} ({margin:.1f}% margin); Tier 5 {totals['Tier 5 Total']:,.2f}.")
+        with st.expander("Totals by Category"):
+            st.dataframe(by_category)
+
+        with st.expander("Compare with Last Known Prices"):
+            threshold_pct = st.number_input("Flag changes larger than (%)", min_value=0.0, value=DEFAULT_THRESHOLD_PCT, step=1.0)
+            if st.button("Compare Prices"):
+                try:
+                    conn = connect()
+                    report = price_delta_report(conn, calculated_df, threshold_pct)
+                    conn.close()
+                    price_report = {"source": calculated_df, "report": report, "threshold": threshold_pct}
+                    st.session_state.price_report = price_report
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"An error occurred while comparing prices: {e}")
+            if price_report is not None:
+                report = price_report["report"]
+                known_parts = int(report["Last Priced"].notna().sum())
+                flagged_parts = int(report["Flagged"].sum())
+                st.info(f"{known_parts} of {len(report)} row(s) have a previous price; {flagged_parts} moved by more than {price_report['threshold']}%.")
+                _, report_page = frame_view_controls(report, "price_report_view", {"Flagged parts only": report["Flagged"].to_numpy()},
+                                                     version=id(report))
+                st.dataframe(report_page)
+
+    with st.expander("Scenario Sweep"):
+        st.write("Price the uploaded invoice under every combination of the values below (separate values with commas).")
+        sweep_col1, sweep_col2, sweep_col3 = st.columns(3)
+        with sweep_col1:
+            sweep_rates = st.text_input("Exchange rates", value=f"{exchange_rate}")
+        with sweep_col2:
+            sweep_freights = st.text_input("Freight costs (AUD)", value=f"{freight_cost}")
+        with sweep_col3:
+            sweep_increases = st.text_input("Markup increases (%)", value="0")
+        if st.button("Run Sweep"):
+            try:
+                grid = scenario_grid(
+                    currencies=[currency],
+                    exchange_rates=[float(v) for v in sweep_rates.split(",") if v.strip()],
+                    freight_costs=[float(v) for v in sweep_freights.split(",") if v.strip()],
+                    markup_increases=[float(v) for v in sweep_increases.split(",") if v.strip()],
+                )
+                # Kept with the summary so the drill-down uses the same freight allocation as the sweep
+                st.session_state.scenario_freight = bind_freight(freight, st.session_state.df)
+                st.session_state.scenario_summary = sweep_scenarios(st.session_state.df, grid, markup_index, category_multipliers,
+                                                                      freight=st.session_state.scenario_freight)
+            except Exception as e:
+                st.error(f"An error occurred during the scenario sweep: {e}")
+        if st.session_state.get('scenario_summary') is not None:
+            summary = st.session_state.scenario_summary
+            st.dataframe(summary.drop(columns=["category_overrides"]))
+            selected = st.selectbox("Show priced rows for scenario", options=list(summary.index),
+                                    format_func=lambda i: f"{i}: rate {summary.at[i, 'exchange_rate']}, freight {summary.at[i, 'freight_cost']}, markup +{summary.at[i, 'markup_increase_pct']}%")
+            drilldown = st.session_state.get('scenario_drilldown')
+            if drilldown is None or drilldown["summary"] is not summary or drilldown["selected"] != selected:
+                drilldown = {"summary": summary, "selected": selected,
+                             "frame": price_scenario(st.session_state.df, summary.loc[selected].to_dict(), markup_index, category_multipliers, compact=True,
+                                                             freight=st.session_state.get('scenario_freight'))}
+                st.session_state.scenario_drilldown = drilldown
+            _, scenario_page = frame_view_controls(drilldown["frame"], "scenario_view")
+            st.dataframe(scenario_page)
+
+    with st.expander("Diagnostics"):
+        st.checkbox("Track memory allocation per stage (slower)", key="track_memory_allocation")
+        if st.session_state.get('calculation_metrics'):
+            metrics_df = pd.DataFrame(st.session_state.calculation_metrics)
+            st.write(f"Last calculation: {metrics_df['seconds'].sum():.3f}s across {len(metrics_df)} stage(s).")
+            st.dataframe(metrics_df[["stage", "seconds", "rows", "rows_per_sec", "alloc_mb", "calls"]])
+        else:
+            st.write("Click 'Calculate Pricing' to record stage timings.")
+
+    if st.session_state.get('download_path') and os.path.exists(st.session_state.download_path):
+        with open(st.session_state.download_path, "rb") as download_file:
+            st.download_button(
+                label="Click here to download",
+                data=download_file,
+                file_name=st.session_state.download_file_name,
+                mime=st.session_state.download_mime_type,
+                key="final_download_button"
+            )
+        # The button has its own copy now, so the temp file can go
+        os.remove(st.session_state.download_path)
+        del st.session_state.download_path
         del st.session_state.download_file_name
         del st.session_state.download_mime_type
\ No newline at end of file
@@ -1,76 +1,55 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-from datetime import datetime
 from database_setup import get_initial_markup_data, get_initial_category_multipliers
+from markup_index import get_markup_index
+from rule_store import save_category_multipliers, save_markup_table
+from snapshots import compile_snapshot, list_snapshots
+from storage import connect
 
 st.set_page_config(page_title="Configure Pricing Rules", layout="wide", page_icon="favicon.png")
 
 st.title("Configure Pricing Rules")
 
-conn = sqlite3.connect("pricing_engine.db")
+conn = connect()
 
-rrpp_tab, category_tab, increase_tab = st.tabs(["RRPP Markup", "Category Multipliers", "Price Increase"])
+rrpp_tab, category_tab, increase_tab, snapshot_tab = st.tabs(["RRPP Markup", "Category Multipliers", "Price Increase", "Snapshots"])
 
 with rrpp_tab:
     st.subheader("🛠️ RRPP Markup Table")
     markup_data = pd.read_sql("SELECT * FROM rrpp_markup_table", conn)
-    if 'original_markup_data' not in st.session_state:
-        st.session_state.original_markup_data = markup_data.copy()
 
     edited_markup = st.data_editor(markup_data, use_container_width=True, num_rows="dynamic", disabled=["From", "To", "timestamp", "change_type"])
+    if get_markup_index(edited_markup).has_overlaps:
+        st.warning("Some RRPP markup bands overlap. A landed cost covered by more than one band uses the first of those bands in table order.")
     if st.button("Save RRPP Markup Table"):
-        diff_mask = edited_markup['RRPP Markup'] != st.session_state.original_markup_data['RRPP Markup']
-        changed_indices = diff_mask[diff_mask].index
-
-        if not changed_indices.empty:
-            for index in changed_indices:
-                edited_markup.loc[index, "timestamp"] = datetime.now()
-                edited_markup.loc[index, "change_type"] = "individual_change"
-            
-            edited_markup.to_sql("rrpp_markup_table", conn, if_exists="replace", index=False)
-            st.success(f"{len(changed_indices)} row(s) saved in RRPP Markup Table.")
-            st.session_state.original_markup_data = edited_markup.copy()
+        # Only rows that differ from the stored table are written, as one new rule version
+        changed_rows = save_markup_table(conn, edited_markup, "individual_change")
+        if changed_rows:
+            st.success(f"{changed_rows} row(s) saved in RRPP Markup Table.")
             st.rerun()
         else:
             st.warning("No changes to save.")
 
     if st.button("Reset RRPP Markup Table"):
-        markup_data = get_initial_markup_data()
-        markup_data["timestamp"] = datetime.now()
-        markup_data["change_type"] = "reset"
-        markup_data.to_sql("rrpp_markup_table", conn, if_exists="replace", index=False)
+        save_markup_table(conn, get_initial_markup_data(), "reset")
         st.success("RRPP Markup Table reset to default.")
         st.rerun()
 
 with category_tab:
     st.subheader("🛠️ Category Multipliers")
     category_multipliers_df = pd.read_sql("SELECT * FROM category_multipliers", conn)
-    if 'original_category_multipliers_df' not in st.session_state:
-        st.session_state.original_category_multipliers_df = category_multipliers_df.copy()
 
     edited_category_multipliers = st.data_editor(category_multipliers_df, use_container_width=True, num_rows="dynamic", disabled=["Category", "timestamp", "change_type"])
     if st.button("Save Category Multipliers"):
-        diff_mask = edited_category_multipliers['Multiplier'] != st.session_state.original_category_multipliers_df['Multiplier']
-        changed_indices = diff_mask[diff_mask].index
-
-        if not changed_indices.empty:
-            for index in changed_indices:
-                edited_category_multipliers.loc[index, "timestamp"] = datetime.now()
-                edited_category_multipliers.loc[index, "change_type"] = "individual_change"
-            
-            edited_category_multipliers.to_sql("category_multipliers", conn, if_exists="replace", index=False)
-            st.success(f"{len(changed_indices)} row(s) saved in Category Multipliers.")
-            st.session_state.original_category_multipliers_df = edited_category_multipliers.copy()
+        changed_rows = save_category_multipliers(conn, edited_category_multipliers, "individual_change")
+        if changed_rows:
+            st.success(f"{changed_rows} row(s) saved in Category Multipliers.")
             st.rerun()
         else:
             st.warning("No changes to save.")
 
     if st.button("Reset Category Multipliers"):
-        category_multipliers_df = get_initial_category_multipliers()
-        category_multipliers_df["timestamp"] = datetime.now()
-        category_multipliers_df["change_type"] = "reset"
-        category_multipliers_df.to_sql("category_multipliers", conn, if_exists="replace", index=False)
+        save_category_multipliers(conn, get_initial_category_multipliers(), "reset")
         st.success("Category Multipliers reset to default.")
         st.rerun()
 
@@ -88,21 +67,31 @@ with increase_tab:
         if increase_target == "RRPP Markup":
             current_markup = pd.read_sql("SELECT * FROM rrpp_markup_table", conn)
             current_markup["RRPP Markup"] = current_markup["RRPP Markup"] * (1 + increase_percentage / 100)
-            current_markup["timestamp"] = datetime.now()
-            current_markup["change_type"] = "price_increase"
-            current_markup.to_sql("rrpp_markup_table", conn, if_exists="replace", index=False)
+            save_markup_table(conn, current_markup, "price_increase")
             st.success(f"RRPP Markup increased by {increase_percentage}%")
         else: # Category Multipliers
             current_multipliers = pd.read_sql("SELECT * FROM category_multipliers", conn)
             if selected_category_for_increase == "All Categories":
                 current_multipliers["Multiplier"] = current_multipliers["Multiplier"] * (1 + increase_percentage / 100)
-                current_multipliers["timestamp"] = datetime.now()
-                current_multipliers["change_type"] = "price_increase"
                 st.success(f"All Category Multipliers increased by {increase_percentage}%")
             else:
                 current_multipliers.loc[current_multipliers["Category"] == selected_category_for_increase, "Multiplier"] *= (1 + increase_percentage / 100)
-                current_multipliers.loc[current_multipliers["Category"] == selected_category_for_increase, "timestamp"] = datetime.now()
-                current_multipliers.loc[current_multipliers["Category"] == selected_category_for_increase, "change_type"] = "price_increase"
                 st.success(f"Category '{selected_category_for_increase}' Multiplier increased by {increase_percentage}%")
-            current_multipliers.to_sql("category_multipliers", conn, if_exists="replace", index=False)
+            save_category_multipliers(conn, current_multipliers, "price_increase")
         st.rerun()
+
+with snapshot_tab:
+    st.subheader("📦 Rule Snapshots")
+    st.info("A snapshot freezes the current markup table and category multipliers. Pricing against a snapshot gives the same prices however the live rules change later.")
+    snapshot_name = st.text_input("Snapshot name (leave blank to name it after the rules version)")
+    if st.button("Compile Snapshot"):
+        try:
+            name = compile_snapshot(name=snapshot_name.strip() or None)
+            st.success(f"Snapshot '{name}' compiled.")
+        except (FileExistsError, ValueError) as e:
+            st.error(str(e))
+    snapshots = list_snapshots()
+    if snapshots:
+        st.dataframe(pd.DataFrame({"Snapshot": snapshots}), hide_index=True)
+    else:
+        st.write("No snapshots compiled yet.")
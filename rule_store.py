@@ -0,0 +1,127 @@
+from datetime import datetime
+import pandas as pd
+from calculations import calculate_pricing
+from freight import freight_from_spec
+from rules import ensure_rules_version_table, get_rules_version
+from snapshots import load_snapshot
+from storage import checkpoint
+
+# rrpp_markup_table and category_multipliers hold the current rules; every change is also
+# appended to markup_rule_log / category_rule_log as a new rule version (see storage._migrate_v5).
+# A log row applies to versions valid_from <= v < valid_to, so the rules of any version are a
+# single indexed range query and nothing is ever overwritten.
+
+_MARKUP = {"table": "rrpp_markup_table", "log": "markup_rule_log", "key": ["From", "To"], "value": "RRPP Markup"}
+_CATEGORY = {"table": "category_multipliers", "log": "category_rule_log", "key": ["Category"], "value": "Multiplier"}
+
+def _quoted(columns):
+    return ", ".join(f'"{col}"' for col in columns)
+
+def _key_match(key):
+    return " AND ".join(f'"{col}" = ?' for col in key)
+
+def _key_rows(frame, key):
+    return list(frame[key].itertuples(index=False, name=None))
+
+def _apply_changes(conn, spec, df, change_type, timestamp=None):
+    # Writes only the rows of df that differ from the current table, in one transaction and
+    # as one new rule version. Returns the number of rows added, changed or removed.
+    table, log, key, value = spec["table"], spec["log"], spec["key"], spec["value"]
+    desired = df.dropna(subset=key).drop_duplicates(subset=key)[key + [value]]
+    current = pd.read_sql(f"SELECT {_quoted(key + [value])} FROM {table}", conn)
+    merged = desired.merge(current, on=key, how="outer", suffixes=("", "_current"), indicator=True)
+    removed = merged[merged["_merge"] == "right_only"]
+    both = merged["_merge"] == "both"
+    same = (merged[value] == merged[f"{value}_current"]) | (merged[value].isna() & merged[f"{value}_current"].isna())
+    # Keep the editor's row order for new rows, which decides precedence between overlapping bands
+    upserts = desired.merge(merged[(merged["_merge"] == "left_only") | (both & ~same)][key], on=key)
+    if upserts.empty and removed.empty:
+        return 0
+
+    timestamp = (timestamp or datetime.now()).isoformat(sep=" ")
+    ensure_rules_version_table(conn)
+    with conn:
+        version = conn.execute('UPDATE rules_version SET "version" = "version" + 1 WHERE "id" = 1 RETURNING "version"').fetchone()[0]
+        conn.execute('INSERT INTO rule_changes ("version", "timestamp", "change_type") VALUES (?, ?, ?)', (version, timestamp, change_type))
+        conn.executemany(f'UPDATE {log} SET "valid_to" = ? WHERE "valid_to" IS NULL AND {_key_match(key)}',
+                         [(version, *row) for row in _key_rows(removed, key) + _key_rows(upserts, key)])
+        conn.executemany(f"DELETE FROM {table} WHERE {_key_match(key)}", _key_rows(removed, key))
+        conn.executemany(
+            f'INSERT INTO {table} ({_quoted(key + [value, "timestamp", "change_type"])}) VALUES ({", ".join("?" * (len(key) + 3))}) '
+            f'ON CONFLICT ({_quoted(key)}) DO UPDATE SET "{value}" = excluded."{value}", "timestamp" = excluded."timestamp", "change_type" = excluded."change_type"',
+            [(*row, timestamp, change_type) for row in upserts[key + [value]].itertuples(index=False, name=None)],
+        )
+        # Positions are rowids of the current table, which keep table order for rows that survive
+        conn.executemany(
+            f'INSERT INTO {log} ({_quoted(key + [value, "position", "valid_from"])}) '
+            f'SELECT {_quoted(key + [value])}, rowid, ? FROM {table} WHERE {_key_match(key)}',
+            [(version, *row) for row in _key_rows(upserts, key)],
+        )
+    checkpoint(conn)
+    return len(upserts) + len(removed)
+
+def save_markup_table(conn, markup_df, change_type, timestamp=None):
+    return _apply_changes(conn, _MARKUP, markup_df, change_type, timestamp)
+
+def save_category_multipliers(conn, category_multipliers_df, change_type, timestamp=None):
+    return _apply_changes(conn, _CATEGORY, category_multipliers_df, change_type, timestamp)
+
+def baseline_version(conn):
+    return conn.execute('SELECT MIN("version") FROM rule_changes').fetchone()[0] or 0
+
+def version_at(conn, timestamp):
+    # The rule version in force at timestamp; times before the log began map to its baseline
+    if not isinstance(timestamp, str):
+        timestamp = timestamp.isoformat(sep=" ")
+    version = conn.execute('SELECT MAX("version") FROM rule_changes WHERE "timestamp" <= ?', (timestamp,)).fetchone()[0]
+    return version if version is not None else baseline_version(conn)
+
+def _log_as_of(conn, spec, version):
+    columns = _quoted(spec["key"] + [spec["value"]])
+    # Two range scans of the (valid_to, valid_from) index: rows still current, and rows
+    # superseded after the requested version
+    return pd.read_sql(
+        f'SELECT {columns}, "position" FROM {spec["log"]} WHERE "valid_to" IS NULL AND "valid_from" <= ? '
+        f'UNION ALL SELECT {columns}, "position" FROM {spec["log"]} WHERE "valid_to" > ? AND "valid_from" <= ? '
+        f'ORDER BY "position"',
+        conn, params=(version, version, version),
+    ).drop(columns="position")
+
+def rules_as_of(conn, version=None, timestamp=None):
+    # (markup table, category multipliers) for a rule version, or for the version in force at
+    # timestamp; with neither, the current rules. Versions older than the log's baseline
+    # (runs saved before the log existed) get the baseline rules.
+    if version is None:
+        version = version_at(conn, timestamp) if timestamp is not None else get_rules_version(conn)
+    version = max(version, baseline_version(conn))
+    markup_data = _log_as_of(conn, _MARKUP, version)
+    category_multipliers = _log_as_of(conn, _CATEGORY, version)
+    return markup_data, dict(zip(category_multipliers["Category"], category_multipliers["Multiplier"]))
+
+def reprice_run(conn, run_id, on_gap="lower"):
+    # Reprices a saved run with its own inputs and the rules it was priced with: its rule
+    # snapshot if it used one, otherwise the logged rule version
+    run = conn.execute(
+        'SELECT "timestamp", "currency", "exchange_rate", "freight_cost", "rules_version", "rules_snapshot", "freight_allocation" '
+        'FROM pricing_runs WHERE "run_id" = ?',
+        (run_id,),
+    ).fetchone()
+    if run is None:
+        raise ValueError(f"No pricing run with run_id {run_id}")
+    timestamp, currency, exchange_rate, freight_cost, rules_version, rules_snapshot, freight_allocation = run
+    freight = freight_from_spec(freight_allocation)
+    if any(col != "Category" for col in freight.columns):
+        # Per-line inputs such as weights are not stored with the run
+        raise ValueError(f"Run {run_id} used {freight.name!r} freight allocation, whose inputs are not saved with the run")
+    parts = pd.read_sql(
+        'SELECT "Qty", "Inv #", "Part Number", "Purchase Cost", "Category" FROM priced_parts WHERE "run_id" = ? ORDER BY rowid',
+        conn, params=(run_id,),
+    )
+    if rules_snapshot:
+        snapshot = load_snapshot(rules_snapshot, on_gap=on_gap)
+        markup_data, category_multipliers = snapshot.markup_data, snapshot.category_multipliers
+    else:
+        markup_data, category_multipliers = rules_as_of(conn, version=rules_version, timestamp=None if rules_version is not None else timestamp)
+    total_purchase = (parts['Qty'].astype(float) * parts['Purchase Cost'].astype(float)).sum()
+    return calculate_pricing(parts, total_purchase, freight_cost or 0.0, currency or "AUD", exchange_rate or 1.0,
+                             markup_data, category_multipliers, on_gap, freight=freight)
@@ -0,0 +1,78 @@
+import threading
+from collections import namedtuple
+import pandas as pd
+from markup_index import get_markup_index
+from storage import DB_PATH, connect
+
+# snapshot is the name of the rule snapshot the rules came from, or None for the live tables
+PricingRules = namedtuple(
+    "PricingRules", ["version", "markup_data", "markup_index", "category_multipliers", "valid_categories", "snapshot"],
+    defaults=(None,),
+)
+
+def load_markup_table(conn):
+    return pd.read_sql("SELECT * FROM rrpp_markup_table", conn)
+
+def load_category_multipliers(conn):
+    category_multipliers_df = pd.read_sql("SELECT * FROM category_multipliers", conn)
+    return pd.Series(category_multipliers_df.Multiplier.values, index=category_multipliers_df.Category).to_dict()
+
+def check_pricing_rules(markup_data, category_multipliers, source):
+    # connect() creates the rule tables empty, so a new or mistyped database would otherwise
+    # price every row at a markup and multiplier of 1.0 without complaint
+    missing = [what for what, empty in (("RRPP markup bands", len(markup_data) == 0), ("category multipliers", not category_multipliers)) if empty]
+    if missing:
+        raise ValueError(f"{source} has no {' and no '.join(missing)}; run database_setup.py to load the default rules")
+
+def load_pricing_rules(db_path=DB_PATH):
+    conn = connect(db_path)
+    try:
+        markup_data, category_multipliers = load_markup_table(conn), load_category_multipliers(conn)
+    finally:
+        conn.close()
+    check_pricing_rules(markup_data, category_multipliers, db_path)
+    return markup_data, category_multipliers
+
+def ensure_rules_version_table(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS rules_version ("id" INTEGER PRIMARY KEY CHECK ("id" = 1), "version" INTEGER NOT NULL)')
+    conn.execute('INSERT OR IGNORE INTO rules_version ("id", "version") VALUES (1, 0)')
+    conn.commit()
+
+def get_rules_version(conn):
+    row = conn.execute('SELECT "version" FROM rules_version WHERE "id" = 1').fetchone()
+    return row[0] if row else 0
+
+# One long-lived connection and compiled rule set per database file, shared by all
+# sessions in the process. Each call only reads the version counter; the tables are
+# re-read and recompiled when the counter has moved.
+_cache_lock = threading.Lock()
+_version_connections = {}
+_rules_cache = {}
+
+def _version_connection(db_path):
+    conn = _version_connections.get(db_path)
+    if conn is None:
+        conn = connect(db_path, check_same_thread=False)
+        ensure_rules_version_table(conn)
+        _version_connections[db_path] = conn
+    return conn
+
+def get_pricing_rules(db_path=DB_PATH, on_gap="lower"):
+    with _cache_lock:
+        conn = _version_connection(db_path)
+        version = get_rules_version(conn)
+        cached = _rules_cache.get((db_path, on_gap))
+        if cached is not None and cached.version == version:
+            return cached
+        markup_data = load_markup_table(conn)
+        category_multipliers = load_category_multipliers(conn)
+        check_pricing_rules(markup_data, category_multipliers, db_path)
+        rules = PricingRules(
+            version,
+            markup_data,
+            get_markup_index(markup_data, on_gap),
+            category_multipliers,
+            list(category_multipliers),
+        )
+        _rules_cache[(db_path, on_gap)] = rules
+        return rules
@@ -0,0 +1,137 @@
+import itertools
+import numpy as np
+import pandas as pd
+from calculations import TIER1_REDUCED_DISCOUNT_CATEGORIES, calculate_pricing, check_exchange_rate, landed_cost_arrays, rrpp_array, tier_arrays
+from freight import DEFAULT_FREIGHT, freight_inputs
+from instrumentation import measure
+from markup_index import get_markup_index
+
+SCENARIO_COLUMNS = ["currency", "exchange_rate", "freight_cost", "markup_increase_pct", "category_overrides"]
+SCENARIO_DEFAULTS = {"currency": "AUD", "exchange_rate": 1.0, "freight_cost": 0.0, "markup_increase_pct": 0.0, "category_overrides": None}
+TOTAL_COLUMNS = ["Landed Cost AUD", "RRPP", "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5"]
+
+# Scenarios x rows priced per block. Blocks this small keep every temporary in cache,
+# which measured faster than pricing all scenarios in one large array.
+SWEEP_BLOCK_CELLS = 65_536
+
+def scenario_grid(currencies=("USD",), exchange_rates=(1.0,), freight_costs=(0.0,), markup_increases=(0.0,), category_overrides=(None,)):
+    # One scenario per combination; category_overrides entries are {category: multiplier} dicts
+    combinations = itertools.product(currencies, exchange_rates, freight_costs, markup_increases, category_overrides)
+    return pd.DataFrame(list(combinations), columns=SCENARIO_COLUMNS)
+
+def _scenario_records(scenarios):
+    if isinstance(scenarios, pd.DataFrame):
+        scenarios = scenarios.to_dict("records")
+    return [{**SCENARIO_DEFAULTS, **scenario} for scenario in scenarios]
+
+def _total_purchase(df):
+    # Same expression as the Calculate and Export page, so sweep and page agree to the cent
+    return (df['Qty'].astype(float) * df['Purchase Cost'].astype(float)).sum()
+
+def _markup_factor(scenario):
+    return 1 + scenario["markup_increase_pct"] / 100
+
+def _scenario_multipliers(category_multipliers, scenario):
+    overrides = scenario["category_overrides"]
+    return {**category_multipliers, **overrides} if isinstance(overrides, dict) else category_multipliers
+
+def _scenario_rules(markup_index, category_multipliers, scenario):
+    factor = _markup_factor(scenario)
+    return (markup_index.scaled(factor) if factor != 1 else markup_index), _scenario_multipliers(category_multipliers, scenario)
+
+def _multiplier_table(multipliers, categories):
+    # Unknown categories and missing multipliers price at 1.0, as category_multiplier_array does
+    values = np.array([multipliers.get(category, np.nan) for category in categories], dtype=float)
+    return np.append(np.nan_to_num(values, nan=1.0), 1.0)
+
+def _landed_cost(qty, purchase_cost, share, total_purchase, freight_cost, currency, exchange_rate):
+    # Same arithmetic as landed_cost_arrays, with the scenario-independent freight share precomputed
+    check_exchange_rate(currency, exchange_rate)
+    purchase_cost_aud = purchase_cost / exchange_rate if currency != "AUD" else purchase_cost
+    if total_purchase > 0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            freight_per_unit = (share * freight_cost) / qty
+        return np.where(qty > 0, purchase_cost_aud + freight_per_unit, purchase_cost_aud)
+    return purchase_cost_aud
+
+def _price_block(batch, landed, band_codes, qty, markup_index, category_codes, categories, reduced_discount, category_multipliers):
+    # Scenarios that share a landed cost, priced as (scenarios, rows) arrays. Lookup tables
+    # keep the fallback in their last slot, so a code of -1 selects it.
+    markup_tables = np.array([np.append(markup_index.markups * _markup_factor(s), markup_index.default_markup) for s in batch])
+    multiplier_tables = np.array([_multiplier_table(_scenario_multipliers(category_multipliers, s), categories) for s in batch])
+    rrpp = rrpp_array(landed, markup_tables[:, band_codes], multiplier_tables[:, category_codes])
+    tiers = tier_arrays(rrpp, reduced_discount)
+    totals = {"RRPP": rrpp @ qty}
+    for i, tier in enumerate(tiers, start=1):
+        totals[f"Tier {i}"] = tier.astype(float) @ qty
+    return totals
+
+def sweep_scenarios(df, scenarios, edited_markup, category_multipliers, on_gap="lower", total_purchase=None,
+                    metrics=None, block_cells=SWEEP_BLOCK_CELLS, freight=None):
+    # Prices the invoice under every scenario and returns one summary row per scenario with
+    # quantity-weighted totals and margins. Rows without a purchase cost are left out.
+    # Landed cost and the markup band depend only on currency, rate and freight, so they
+    # are computed once per distinct combination and shared by its markup and category variants.
+    scenarios = _scenario_records(scenarios)
+    markup_index = get_markup_index(edited_markup, on_gap)
+    if total_purchase is None:
+        total_purchase = _total_purchase(df)
+
+    qty = df['Qty'].to_numpy(dtype=float)
+    purchase_cost = df['Purchase Cost'].to_numpy(dtype=float)
+    priced = ~np.isnan(purchase_cost)
+    qty, purchase_cost = qty[priced], purchase_cost[priced]
+    categories = pd.Categorical(df['Category'].to_numpy()[priced])
+    category_codes = categories.codes.astype(np.intp)
+    reduced_discount = pd.Series(categories).isin(TIER1_REDUCED_DISCOUNT_CATEGORIES).to_numpy()
+    share = (qty * purchase_cost) / total_purchase if total_purchase > 0 else None
+    if freight is not None and freight != DEFAULT_FREIGHT:
+        inputs = {col: values.to_numpy()[priced] for col, values in freight_inputs(freight, df).items()}
+
+    groups = {}
+    for position, scenario in enumerate(scenarios):
+        rate = None if scenario["currency"] == "AUD" else scenario["exchange_rate"]
+        groups.setdefault((rate, scenario["freight_cost"]), []).append(position)
+
+    totals = {name: np.zeros(len(scenarios)) for name in TOTAL_COLUMNS}
+    row_block = max(1, min(len(qty), block_cells))
+    scenario_block = max(1, block_cells // row_block)
+    for positions in groups.values():
+        first = scenarios[positions[0]]
+        with measure(metrics, 'landed_cost', len(qty)):
+            if freight is None or freight == DEFAULT_FREIGHT:
+                landed = _landed_cost(qty, purchase_cost, share, total_purchase, first["freight_cost"], first["currency"], first["exchange_rate"])
+            else:
+                landed = landed_cost_arrays(qty, purchase_cost, total_purchase, first["freight_cost"], first["currency"], first["exchange_rate"], freight, inputs)[1]
+            band_codes = markup_index.resolved_codes(landed).astype(np.intp)
+        totals["Landed Cost AUD"][positions] = landed @ qty
+        for start in range(0, len(positions), scenario_block):
+            chunk = positions[start:start + scenario_block]
+            batch = [scenarios[i] for i in chunk]
+            with measure(metrics, 'rrpp_and_tiers', len(qty) * len(chunk)):
+                for row in range(0, len(qty), row_block):
+                    rows = slice(row, row + row_block)
+                    block_totals = _price_block(batch, landed[rows], band_codes[rows], qty[rows], markup_index, category_codes[rows],
+                                                categories.categories, reduced_discount[rows], category_multipliers)
+                    for name, values in block_totals.items():
+                        totals[name][chunk] += values
+
+    summary = pd.DataFrame(scenarios, columns=SCENARIO_COLUMNS)
+    summary["Priced Rows"] = len(qty)
+    for name in TOTAL_COLUMNS:
+        summary[f"{name} Total"] = totals[name]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name in ["RRPP", "Tier 5"]:
+            summary[f"{name} Margin %"] = (1 - summary["Landed Cost AUD Total"] / summary[f"{name} Total"]) * 100
+    return summary
+
+def price_scenario(df, scenario, edited_markup, category_multipliers, on_gap="lower", total_purchase=None, compact=False, freight=None):
+    # Drill-down: the full priced frame for one scenario, identical to pricing it on the page
+    scenario = _scenario_records([scenario])[0]
+    markup_index, multipliers = _scenario_rules(get_markup_index(edited_markup, on_gap), category_multipliers, scenario)
+    priced = df.copy()
+    priced['Purchase Cost'] = priced['Purchase Cost'].astype(float)
+    if total_purchase is None:
+        total_purchase = _total_purchase(priced)
+    return calculate_pricing(priced, total_purchase, scenario["freight_cost"], scenario["currency"], scenario["exchange_rate"],
+                             markup_index, multipliers, on_gap, compact=compact, freight=freight)
@@ -0,0 +1,118 @@
+import hashlib
+import io
+import os
+import re
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from markup_index import get_markup_index
+from rules import PricingRules, check_pricing_rules, get_rules_version, load_category_multipliers, load_markup_table
+from storage import DB_PATH, connect
+
+SNAPSHOT_DIR = "rule_snapshots"
+SNAPSHOT_SUFFIX = ".npz"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]*")
+
+# A snapshot is an uncompressed .npz of a handful of small arrays: band edges and markups
+# in table order, category names and their multipliers. Files are never overwritten, so a
+# snapshot name always means the same rules.
+
+def check_snapshot_name(name):
+    # Names come from the UI and the command line and only ever become a file name inside
+    # the snapshot directory, never a path
+    if not isinstance(name, str) or not SNAPSHOT_NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid snapshot name {name!r}: use letters, digits, '.', '_' and '-', not starting with '.'")
+    return name
+
+def snapshot_path(name, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, check_snapshot_name(name) + SNAPSHOT_SUFFIX)
+
+def _snapshot_arrays(markup_data, category_multipliers, rules_version):
+    return {
+        "format": np.array(SNAPSHOT_FORMAT),
+        "rules_version": np.array(rules_version),
+        "band_from": markup_data["From"].to_numpy(dtype=float),
+        "band_to": markup_data["To"].to_numpy(dtype=float),
+        "band_markup": markup_data["RRPP Markup"].to_numpy(dtype=float),
+        "categories": np.array(list(category_multipliers), dtype=str),
+        "multipliers": np.array(list(category_multipliers.values()), dtype=float),
+    }
+
+def _digest(arrays):
+    # Content hash of the rules alone, so compiling unchanged rules twice gives the same name
+    digest = hashlib.blake2b(digest_size=4)
+    for key in ("band_from", "band_to", "band_markup", "categories", "multipliers"):
+        digest.update(arrays[key].tobytes())
+    return digest.hexdigest()
+
+def compile_snapshot(db_path=DB_PATH, name=None, directory=SNAPSHOT_DIR):
+    # Writes the live rules to a new snapshot file and returns its name
+    conn = connect(db_path)
+    try:
+        markup_data = load_markup_table(conn)
+        category_multipliers = load_category_multipliers(conn)
+        rules_version = get_rules_version(conn)
+    finally:
+        conn.close()
+    check_pricing_rules(markup_data, category_multipliers, db_path)
+    arrays = _snapshot_arrays(markup_data, category_multipliers, rules_version)
+    name = name or f"rules-v{rules_version}-{_digest(arrays)}"
+    arrays["name"] = np.array(name)
+    arrays["created"] = np.array(datetime.now().isoformat(sep=" ", timespec="seconds"))
+
+    path = snapshot_path(name, directory)
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(path):
+        existing = _read_arrays(path)
+        if _digest(existing) != _digest(arrays):
+            raise FileExistsError(f"Snapshot {name!r} already exists with different rules")
+        return name
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    # Written under a temporary name and renamed, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+    return name
+
+def _read_arrays(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def list_snapshots(directory=SNAPSHOT_DIR):
+    if not os.path.isdir(directory):
+        return []
+    names = [f[:-len(SNAPSHOT_SUFFIX)] for f in os.listdir(directory) if f.endswith(SNAPSHOT_SUFFIX)]
+    # Files that could not have been written under a valid name are not snapshots
+    names = [name for name in names if SNAPSHOT_NAME_PATTERN.fullmatch(name)]
+    return sorted(names, key=lambda n: os.path.getmtime(snapshot_path(n, directory)), reverse=True)
+
+_snapshot_lock = threading.Lock()
+_snapshot_cache = {}
+
+def load_snapshot(name, directory=SNAPSHOT_DIR, on_gap="lower"):
+    # Snapshots are immutable, so each one is read and compiled once per process
+    path = os.path.abspath(snapshot_path(name, directory))
+    with _snapshot_lock:
+        cached = _snapshot_cache.get((path, on_gap))
+        if cached is not None:
+            return cached
+        arrays = _read_arrays(path)
+        if int(arrays["format"]) != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {int(arrays['format'])} in {path}")
+        markup_data = pd.DataFrame({"From": arrays["band_from"], "To": arrays["band_to"], "RRPP Markup": arrays["band_markup"]})
+        category_multipliers = dict(zip(arrays["categories"].tolist(), arrays["multipliers"].tolist()))
+        check_pricing_rules(markup_data, category_multipliers, f"Snapshot {name!r}")
+        rules = PricingRules(
+            int(arrays["rules_version"]),
+            markup_data,
+            get_markup_index(markup_data, on_gap),
+            category_multipliers,
+            list(category_multipliers),
+            str(arrays["name"]),
+        )
+        _snapshot_cache[(path, on_gap)] = rules
+        return rules
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+from datetime import datetime
+import numpy as np
+
+# The -wal and -shm files live next to the database, so a container must mount its whole
+# directory; docker-compose points this at /app/data
+DB_PATH = os.environ.get("PRICING_ENGINE_DB", "pricing_engine.db")
+INSERT_BATCH_SIZE = 50_000
+
+PRICED_PARTS_COLUMNS = [
+    "Qty", "Inv #", "Part Number", "Purchase Cost", "Category",
+    "Purchase Cost AUD", "Landed Cost AUD", "RRPP Markup", "Category Multiplier", "RRPP",
+    "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5",
+]
+
+# Price columns kept per part in latest_prices
+LATEST_PRICE_COLUMNS = ["Landed Cost AUD", "RRPP", "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5"]
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA busy_timeout = 5000",
+]
+
+def connect(db_path=DB_PATH, check_same_thread=True):
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    return conn
+
+def checkpoint(conn):
+    # Folds committed pages back into the database after large writes, so the -wal file
+    # does not keep growing while readers hold it open
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def _migrate_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pricing_runs (
+            "run_id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "timestamp" TEXT NOT NULL,
+            "row_count" INTEGER NOT NULL,
+            "currency" TEXT,
+            "exchange_rate" REAL,
+            "freight_cost" REAL,
+            "rules_version" INTEGER,
+            "source" TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS priced_parts (
+            "Qty" REAL,
+            "Inv #" TEXT,
+            "Part Number" TEXT,
+            "Purchase Cost" REAL,
+            "Category" TEXT,
+            "Purchase Cost AUD" REAL,
+            "Landed Cost AUD" REAL,
+            "RRPP Markup" REAL,
+            "Category Multiplier" REAL,
+            "RRPP" REAL,
+            "Tier 1" REAL,
+            "Tier 2" REAL,
+            "Tier 3" REAL,
+            "Tier 4" REAL,
+            "Tier 5" REAL,
+            "timestamp" TEXT
+        )
+    """)
+    # Databases created by database_setup.py before runs existed have no run_id column
+    if "run_id" not in _columns(conn, "priced_parts"):
+        conn.execute('ALTER TABLE priced_parts ADD COLUMN "run_id" INTEGER REFERENCES pricing_runs("run_id")')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_priced_parts_part_timestamp ON priced_parts ("Part Number", "timestamp")')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_priced_parts_timestamp ON priced_parts ("timestamp")')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_priced_parts_run_id ON priced_parts ("run_id")')
+
+def _migrate_v2(conn):
+    # Latest price per part, kept current by save_priced_parts, so history comparisons
+    # never have to scan priced_parts
+    price_columns = ", ".join(f'"{col}" REAL' for col in LATEST_PRICE_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS latest_prices (
+            "Part Number" TEXT PRIMARY KEY,
+            {price_columns},
+            "timestamp" TEXT,
+            "run_id" INTEGER
+        )
+    ''')
+    selected = ", ".join(f'"{col}"' for col in ["Part Number"] + LATEST_PRICE_COLUMNS + ["timestamp", "run_id"])
+    conn.execute(f'''
+        INSERT OR REPLACE INTO latest_prices ({selected})
+        SELECT {selected} FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY "Part Number" ORDER BY "timestamp" DESC, rowid DESC) AS rank
+            FROM priced_parts WHERE "Part Number" IS NOT NULL
+        ) WHERE rank = 1
+    ''')
+
+def _migrate_v3(conn):
+    # Name of the rule snapshot a run was priced against; NULL for the live rule tables
+    if "rules_snapshot" not in _columns(conn, "pricing_runs"):
+        conn.execute('ALTER TABLE pricing_runs ADD COLUMN "rules_snapshot" TEXT')
+
+def _migrate_v4(conn):
+    # Background pricing jobs (see jobs.py): one row per job and one per row chunk
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pricing_jobs (
+            "job_id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "status" TEXT NOT NULL,
+            "created" TEXT NOT NULL,
+            "started" TEXT,
+            "finished" TEXT,
+            "row_count" INTEGER NOT NULL,
+            "chunk_count" INTEGER NOT NULL,
+            "chunks_done" INTEGER NOT NULL DEFAULT 0,
+            "currency" TEXT,
+            "exchange_rate" REAL,
+            "freight_cost" REAL,
+            "total_purchase" REAL,
+            "on_gap" TEXT,
+            "rules_snapshot" TEXT,
+            "source" TEXT,
+            "job_path" TEXT,
+            "error" TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pricing_job_chunks (
+            "job_id" INTEGER NOT NULL REFERENCES pricing_jobs("job_id"),
+            "chunk" INTEGER NOT NULL,
+            "start_row" INTEGER NOT NULL,
+            "stop_row" INTEGER NOT NULL,
+            "status" TEXT NOT NULL,
+            "worker_pid" INTEGER,
+            PRIMARY KEY ("job_id", "chunk")
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pricing_job_chunks_status ON pricing_job_chunks ("status", "job_id", "chunk")')
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def _migrate_v5(conn):
+    # The rule tables become the current state of an append-only change log (rule_store.py).
+    # A log row applies to rule versions valid_from <= v < valid_to; valid_to is NULL while current.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rrpp_markup_table (
+            "From" REAL,
+            "To" REAL,
+            "RRPP Markup" REAL,
+            "timestamp" TEXT,
+            "change_type" TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS category_multipliers (
+            "Category" TEXT,
+            "Multiplier" REAL,
+            "timestamp" TEXT,
+            "change_type" TEXT
+        )
+    """)
+    # Upserts need unique keys; of any duplicates, keep the first row, which lookups already used
+    conn.execute('DELETE FROM rrpp_markup_table WHERE rowid NOT IN (SELECT MIN(rowid) FROM rrpp_markup_table GROUP BY "From", "To")')
+    conn.execute('DELETE FROM category_multipliers WHERE rowid NOT IN (SELECT MIN(rowid) FROM category_multipliers GROUP BY "Category")')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_rrpp_markup_band ON rrpp_markup_table ("From", "To")')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_category_multipliers_category ON category_multipliers ("Category")')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rule_changes (
+            "version" INTEGER PRIMARY KEY,
+            "timestamp" TEXT NOT NULL,
+            "change_type" TEXT
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_rule_changes_timestamp ON rule_changes ("timestamp")')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS markup_rule_log (
+            "From" REAL,
+            "To" REAL,
+            "RRPP Markup" REAL,
+            "position" INTEGER,
+            "valid_from" INTEGER NOT NULL,
+            "valid_to" INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS category_rule_log (
+            "Category" TEXT,
+            "Multiplier" REAL,
+            "position" INTEGER,
+            "valid_from" INTEGER NOT NULL,
+            "valid_to" INTEGER
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_markup_rule_log_validity ON markup_rule_log ("valid_to", "valid_from")')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_category_rule_log_validity ON category_rule_log ("valid_to", "valid_from")')
+
+    # The rules in place today become the baseline version of the log
+    version = 0
+    if _table_exists(conn, "rules_version"):
+        row = conn.execute('SELECT "version" FROM rules_version WHERE "id" = 1').fetchone()
+        version = row[0] if row else 0
+    conn.execute('INSERT OR IGNORE INTO rule_changes ("version", "timestamp", "change_type") VALUES (?, ?, ?)',
+                 (version, datetime.now().isoformat(sep=" "), "baseline"))
+    conn.execute('INSERT INTO markup_rule_log SELECT "From", "To", "RRPP Markup", rowid, ?, NULL FROM rrpp_markup_table', (version,))
+    conn.execute('INSERT INTO category_rule_log SELECT "Category", "Multiplier", rowid, ?, NULL FROM category_multipliers', (version,))
+
+def _migrate_v6(conn):
+    # Freight allocation a run was priced with, as JSON from freight.freight_spec; NULL for the value-based default
+    if "freight_allocation" not in _columns(conn, "pricing_runs"):
+        conn.execute('ALTER TABLE pricing_runs ADD COLUMN "freight_allocation" TEXT')
+
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6]
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    with conn:
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+def save_priced_parts(conn, df, timestamp=None, currency=None, exchange_rate=None, freight_cost=None,
+                      rules_version=None, source=None, rules_snapshot=None, freight_allocation=None):
+    # One transaction for the run row and every part row; returns the new run_id. Rows left
+    # unpriced (no purchase cost) are not part of the price history.
+    if "RRPP" in df.columns:
+        priced = np.isfinite(df["RRPP"].to_numpy(dtype=float))
+        if not priced.all():
+            df = df[priced]
+    timestamp = (timestamp or datetime.now()).isoformat(sep=" ")
+    columns = [col for col in PRICED_PARTS_COLUMNS if col in df.columns]
+    insert_columns = columns + ["timestamp", "run_id"]
+    sql = 'INSERT INTO priced_parts ({}) VALUES ({})'.format(
+        ", ".join(f'"{col}"' for col in insert_columns), ", ".join("?" * len(insert_columns)),
+    )
+    latest_columns = ["Part Number"] + [col for col in LATEST_PRICE_COLUMNS if col in df.columns] + ["timestamp", "run_id"]
+    upsert_sql = 'INSERT INTO latest_prices ({}) VALUES ({}) ON CONFLICT ("Part Number") DO UPDATE SET {} WHERE excluded."timestamp" >= latest_prices."timestamp"'.format(
+        ", ".join(f'"{col}"' for col in latest_columns), ", ".join("?" * len(latest_columns)),
+        ", ".join(f'"{col}" = excluded."{col}"' for col in latest_columns[1:]),
+    )
+    with conn:
+        run_id = conn.execute(
+            'INSERT INTO pricing_runs ("timestamp", "row_count", "currency", "exchange_rate", "freight_cost", "rules_version", "source", "rules_snapshot", "freight_allocation") '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (timestamp, len(df), currency, exchange_rate, freight_cost, rules_version, source, rules_snapshot, freight_allocation),
+        ).lastrowid
+        for start in range(0, len(df), INSERT_BATCH_SIZE):
+            # tolist() turns NumPy scalars into Python values that sqlite3 can bind; SQLite stores NaN as NULL
+            batch = df[columns].iloc[start:start + INSERT_BATCH_SIZE]
+            values = [batch[col].tolist() for col in columns]
+            values += [[timestamp] * len(batch), [run_id] * len(batch)]
+            conn.executemany(sql, zip(*values))
+            if "Part Number" in columns:
+                latest = [values[insert_columns.index(col)] for col in latest_columns]
+                conn.executemany(upsert_sql, (row for row in zip(*latest) if row[0] is not None and row[0] == row[0]))
+    checkpoint(conn)
+    return run_id
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import pandas as pd
+from calculations import calculate_pricing
+from export import EXPORT_DROP_COLUMNS, write_export
+from freight import freight_inputs
+from instrumentation import measure
+from ingestion import CSV_READ_OPTIONS, clean_purchase_cost, clean_purchase_frame, clean_qty, read_purchase_frame
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+def _source_name(source):
+    return os.fspath(source) if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+def _iter_excel_chunks(source, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if name is None else str(name) for name in header]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+def read_purchase_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, usecols=None):
+    _rewind(source)
+    name = _source_name(source).lower()
+    if name.endswith(".csv"):
+        yield from pd.read_csv(source, chunksize=chunk_size, usecols=usecols, **CSV_READ_OPTIONS)
+    elif name.endswith(".xlsx"):
+        for chunk in _iter_excel_chunks(source, chunk_size):
+            chunk.columns = chunk.columns.str.strip()
+            yield chunk[[col for col in chunk.columns if usecols is None or col in usecols]]
+    else:
+        # Legacy .xls files cannot be read row by row; slice the parsed sheet instead
+        df = read_purchase_frame(source, name)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+def _clean_cost_columns(df):
+    df.columns = df.columns.astype(str).str.strip()
+    return clean_qty(df['Qty']), clean_purchase_cost(df['Purchase Cost'])
+
+def compute_total_purchase(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    # First pass: only Qty and Purchase Cost are parsed, one chunk at a time
+    name = _source_name(source).lower()
+    usecols = (lambda col: col.strip() in ("Qty", "Purchase Cost")) if name.endswith(".csv") else None
+    total_purchase = 0.0
+    for chunk in read_purchase_chunks(source, chunk_size, usecols=usecols):
+        qty, purchase_cost = _clean_cost_columns(chunk)
+        total_purchase += (qty.astype(float) * purchase_cost).sum()
+    return total_purchase
+
+def bind_freight_to_file(source, freight, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Extra first pass for freight strategies that share the freight cost across the whole
+    # file (by weight): only Qty and the columns the strategy reads are parsed
+    name = _source_name(source).lower()
+    wanted = {"Qty", *freight.columns}
+    usecols = (lambda col: col.strip() in wanted) if name.endswith(".csv") else None
+    totals = freight.invoice_totals(np.zeros(0), {col: pd.Series([], dtype=float) for col in freight.columns})
+    for chunk in read_purchase_chunks(source, chunk_size, usecols=usecols):
+        chunk.columns = chunk.columns.astype(str).str.strip()
+        chunk_totals = freight.invoice_totals(clean_qty(chunk['Qty']).to_numpy(dtype=float), freight_inputs(freight, chunk))
+        totals = tuple(a + b for a, b in zip(totals, chunk_totals))
+    return freight.bind(totals)
+
+def price_chunks(source, freight_cost, currency, exchange_rate, edited_markup, category_multipliers,
+                 chunk_size=DEFAULT_CHUNK_SIZE, total_purchase=None, default_category="", on_gap="lower", metrics=None, freight=None):
+    if total_purchase is None:
+        with measure(metrics, 'total_purchase_pass'):
+            total_purchase = compute_total_purchase(source, chunk_size)
+    if freight is not None and not freight.is_bound:
+        with measure(metrics, 'freight_totals_pass'):
+            freight = bind_freight_to_file(source, freight, chunk_size)
+    chunks = read_purchase_chunks(source, chunk_size)
+    while True:
+        with measure(metrics, 'read'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        with measure(metrics, 'clean', len(chunk)):
+            chunk = clean_purchase_frame(chunk, default_category)
+            chunk['Qty'] = chunk['Qty'].astype(float)
+        yield calculate_pricing(chunk, total_purchase, freight_cost, currency, exchange_rate,
+                                edited_markup, category_multipliers, on_gap, metrics, freight=freight)
+
+def price_file_to_export(source, output, freight_cost, currency, exchange_rate, edited_markup, category_multipliers,
+                         chunk_size=DEFAULT_CHUNK_SIZE, total_purchase=None, default_category="", on_gap="lower",
+                         fmt="csv", compression=None, drop_columns=EXPORT_DROP_COLUMNS, metrics=None, freight=None):
+    chunks = price_chunks(source, freight_cost, currency, exchange_rate, edited_markup, category_multipliers,
+                          chunk_size, total_purchase, default_category, on_gap, metrics, freight)
+    return write_export(chunks, output, fmt, compression, drop_columns, metrics)
+
+def price_file_to_csv(source, output, freight_cost, currency, exchange_rate, edited_markup, category_multipliers,
+                      chunk_size=DEFAULT_CHUNK_SIZE, total_purchase=None, default_category="", on_gap="lower",
+                      drop_columns=EXPORT_DROP_COLUMNS, metrics=None):
+    return price_file_to_export(source, output, freight_cost, currency, exchange_rate, edited_markup, category_multipliers,
+                                chunk_size, total_purchase, default_category, on_gap, "csv", None, drop_columns, metrics)
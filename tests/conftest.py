@@ -0,0 +1,15 @@
+import pytest
+from database_setup import get_initial_category_multipliers, get_initial_markup_data
+from rule_store import save_category_multipliers, save_markup_table
+from storage import connect
+
+@pytest.fixture
+def rules_db(tmp_path, monkeypatch):
+    # A fresh database holding the default rules; snapshots are written under tmp_path
+    monkeypatch.chdir(tmp_path)
+    db_path = str(tmp_path / "pricing_engine.db")
+    conn = connect(db_path)
+    save_markup_table(conn, get_initial_markup_data(), "initial_load")
+    save_category_multipliers(conn, get_initial_category_multipliers(), "initial_load")
+    conn.close()
+    return db_path
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+from calculations import calculate_landed_cost, calculate_pricing, calculate_rrpp, calculate_tiered_pricing, reprice_changed_rows
+from database_setup import get_initial_category_multipliers, get_initial_markup_data
+from freight import bind_freight, freight_strategy
+
+# Golden-output checks against the original row-by-row implementation, kept here verbatim
+# as the reference. The old markup lookup fell back to 1.0 outside the table, which is
+# on_gap="flag" in the vectorized kernel.
+
+def reference_landed_cost(df, total_purchase, freight_cost, currency, exchange_rate):
+    df['Purchase Cost AUD'] = df['Purchase Cost'] / exchange_rate if currency != "AUD" else df['Purchase Cost']
+    if total_purchase > 0:
+        df['Landed Cost AUD'] = df.apply(
+            lambda row: row['Purchase Cost AUD'] + (((row['Qty'] * row['Purchase Cost']) / total_purchase) * freight_cost) / row['Qty']
+            if row['Qty'] > 0 else row['Purchase Cost AUD'],
+            axis=1
+        )
+    else:
+        df['Landed Cost AUD'] = df['Purchase Cost AUD']
+    return df
+
+def reference_lookup_rrpp_markup(cost, edited_markup):
+    row = edited_markup[(edited_markup['From'] <= cost) & (cost <= edited_markup['To'])]
+    return float(row['RRPP Markup'].iloc[0]) if not row.empty else 1.0
+
+def reference_rrpp(df, edited_markup, category_multipliers):
+    df['RRPP Markup'] = df['Landed Cost AUD'].apply(lambda cost: reference_lookup_rrpp_markup(cost, edited_markup))
+    df['Category Multiplier'] = df['Category'].map(category_multipliers).fillna(1.0)
+    df['RRPP'] = (df['Landed Cost AUD'] * ((df['RRPP Markup'] * df['Category Multiplier']) + 1)).round(0)
+    return df
+
+def reference_tiered_pricing(df):
+    df['Tier 1'] = df.apply(lambda row: round(row['RRPP'] * 0.95 if row['Category'] in ['Speciality Fast', 'Universal', 'Local'] else row['RRPP'] * 0.9), axis=1)
+    df['Tier 2'] = df.apply(lambda row: round(row['RRPP'] * 1.37) if ((-row['RRPP'] + (row['Tier 1'] * 0.95)) / row['RRPP']) > 0.37 else round(row['Tier 1'] * 0.95), axis=1)
+    df['Tier 3'] = df.apply(lambda row: round(row['RRPP'] * 1.35) if ((-row['RRPP'] + (row['Tier 2'] * 0.9)) / row['RRPP']) > 0.35 else round(row['Tier 2'] * 0.9), axis=1)
+    df['Tier 4'] = df.apply(lambda row: round(row['RRPP'] * 1.3) if ((-row['RRPP'] + (row['Tier 3'] * 0.85)) / row['RRPP']) > 0.3 else round(row['Tier 3'] * 0.85), axis=1)
+    df['Tier 5'] = df.apply(lambda row: round(row['RRPP'] * 1.25) if ((-row['RRPP'] + (row['Tier 4'] * 0.95)) / row['RRPP']) > 0.25 else round(row['Tier 4'] * 0.95), axis=1)
+    return df
+
+TIER_COLUMNS = [f"Tier {i}" for i in range(1, 6)]
+SCENARIOS = [("USD", 0.65, 1200.0), ("AUD", 1.0, 0.0), ("USD", 0.7, 0.0), ("AUD", 1.0, 55.5)]
+
+@pytest.fixture
+def markup():
+    return get_initial_markup_data()
+
+@pytest.fixture
+def multipliers():
+    categories = get_initial_category_multipliers()
+    return dict(zip(categories["Category"], categories["Multiplier"]))
+
+def invoice(multipliers, rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    costs = np.concatenate([rng.uniform(0, 3000, rows - 6), [2.495, 0.0, 4.99, 5000, 2.5, 7000]])
+    return pd.DataFrame({
+        # Qty 0 rows take the no-freight fallback
+        "Qty": rng.integers(0, 20, rows).astype(float),
+        "Inv #": "INV",
+        "Part Number": [f"P{i}" for i in range(rows)],
+        "Purchase Cost": np.round(costs, 2),
+        "Category": rng.choice(list(multipliers) + ["Unknown"], rows),
+    })
+
+def reference_pricing(df, total_purchase, freight_cost, currency, exchange_rate, markup, multipliers):
+    priced = reference_rrpp(reference_landed_cost(df.copy(), total_purchase, freight_cost, currency, exchange_rate), markup, multipliers)
+    # The reference divides by RRPP when tiering, so it cannot price RRPP == 0
+    return reference_tiered_pricing(priced[priced["RRPP"] != 0].copy())
+
+def assert_same_prices(expected, actual):
+    actual = actual.loc[expected.index].copy()
+    for col in TIER_COLUMNS:
+        actual[col] = actual[col].astype("int64")
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_exact=True)
+
+@pytest.mark.parametrize("currency, exchange_rate, freight_cost", SCENARIOS)
+def test_calculate_pricing_matches_reference(markup, multipliers, currency, exchange_rate, freight_cost):
+    df = invoice(multipliers)
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    expected = reference_pricing(df, total_purchase, freight_cost, currency, exchange_rate, markup, multipliers)
+    assert (expected["Qty"] == 0).any()
+    actual = calculate_pricing(df.copy(), total_purchase, freight_cost, currency, exchange_rate, markup, multipliers, on_gap="flag")
+    assert_same_prices(expected, actual)
+
+@pytest.mark.parametrize("currency, exchange_rate, freight_cost", SCENARIOS)
+def test_stage_functions_match_reference(markup, multipliers, currency, exchange_rate, freight_cost):
+    df = invoice(multipliers, seed=1)
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    expected = reference_pricing(df, total_purchase, freight_cost, currency, exchange_rate, markup, multipliers)
+    actual = calculate_landed_cost(df.copy(), total_purchase, freight_cost, currency, exchange_rate)
+    actual = calculate_rrpp(actual, markup, multipliers, on_gap="flag")
+    actual = calculate_tiered_pricing(actual.loc[expected.index].copy())
+    assert_same_prices(expected, actual)
+
+def test_tiers_round_half_to_even():
+    # x.5 products at every step, for both tier 1 discounts
+    rrpp = [5.0, 15.0, 25.0, 35.0, 10.0, 30.0, 50.0, 70.0, 90.0, 110.0]
+    df = pd.DataFrame({
+        "RRPP": rrpp * 2,
+        "Category": ["Speciality"] * len(rrpp) + ["Universal"] * len(rrpp),
+    })
+    expected = reference_tiered_pricing(df.copy())
+    assert_same_prices(expected, calculate_tiered_pricing(df.copy()))
+
+def test_missing_purchase_cost_leaves_row_unpriced(markup, multipliers):
+    df = invoice(multipliers, rows=200, seed=2)
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    df.loc[[3, 50], "Purchase Cost"] = np.nan
+    actual = calculate_pricing(df.copy(), total_purchase, 300.0, "USD", 0.65, markup, multipliers, on_gap="flag")
+    assert actual.loc[[3, 50], "RRPP"].isna().all()
+    assert actual.loc[[3, 50], TIER_COLUMNS].isna().all().all()
+    # Every other row prices exactly as it would without the missing costs
+    expected = reference_pricing(df.drop(index=[3, 50]), total_purchase, 300.0, "USD", 0.65, markup, multipliers)
+    assert_same_prices(expected, actual)
+
+def test_zero_exchange_rate_is_rejected(markup, multipliers):
+    df = invoice(multipliers, rows=10)
+    with pytest.raises(ValueError):
+        calculate_pricing(df, 100.0, 0.0, "USD", 0.0, markup, multipliers)
+
+EDITED_ROWS = [1, 5, 17, 40, 41]
+
+def edit_invoice(df, edit):
+    df = df.copy()
+    if edit == "category":
+        df.loc[EDITED_ROWS, "Category"] = ["Universal", "Local", "Unknown", "Speciality", "Universal"]
+    else:
+        # Twice the quantity at half the cost and weight keeps the invoice totals, so the page
+        # would take the incremental path for this edit
+        df.loc[EDITED_ROWS, "Qty"] = df.loc[EDITED_ROWS, "Qty"] * 2
+        df.loc[EDITED_ROWS, "Purchase Cost"] = df.loc[EDITED_ROWS, "Purchase Cost"] / 2
+        df.loc[EDITED_ROWS, "Weight"] = df.loc[EDITED_ROWS, "Weight"] / 2
+    return df
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("edit", ["category", "qty_cost"])
+@pytest.mark.parametrize("freight", [freight_strategy("weight"), freight_strategy("category", rates={"Universal": 4.0, "Local": 1.5}, default_pct=2.0)])
+def test_reprice_changed_rows_matches_full_pricing(markup, multipliers, compact, edit, freight):
+    df = invoice(multipliers, rows=200, seed=3)
+    df["Weight"] = np.round(np.random.default_rng(3).uniform(0.1, 20, len(df)), 2)
+    df["Category"] = np.where(df.index.isin(EDITED_ROWS), "Speciality Fast", df["Category"])
+    edited = edit_invoice(df, edit)
+
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    assert (edited["Qty"] * edited["Purchase Cost"]).sum() == total_purchase
+    bound = bind_freight(freight, df)
+    assert bind_freight(freight, edited) == bound
+    args = (total_purchase, 300.0, "USD", 0.65, markup, multipliers)
+    previous = calculate_pricing(df.copy(), *args, compact=compact, freight=bound)
+
+    repriced, repriced_rows = reprice_changed_rows(edited.copy(), previous, *args, freight=bound)
+    assert repriced_rows == len(EDITED_ROWS)
+    pd.testing.assert_frame_equal(repriced, calculate_pricing(edited.copy(), *args, compact=compact, freight=bound))
@@ -0,0 +1,37 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from export import EXPORT_DROP_COLUMNS, export_to_tempfile, frame_chunks, write_export
+
+def priced_frame(rows):
+    return pd.DataFrame({
+        "Part Number": [f"P{i}" for i in range(rows)],
+        "Category": pd.Series(["Universal", "N/A"] * (rows // 2), dtype="category"),
+        "RRPP": np.arange(rows, dtype=float),
+        "Tier 1": pd.array(range(rows), dtype="Int32"),
+        "RRPP Markup": 1.0,
+    })
+
+def read_back(data, fmt):
+    if fmt == "csv":
+        return pd.read_csv(io.BytesIO(data))
+    if fmt == "parquet":
+        return pd.read_parquet(io.BytesIO(data))
+    return pd.read_excel(io.BytesIO(data))
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "xlsx"])
+@pytest.mark.parametrize("rows", [0, 6])
+def test_export_keeps_columns(fmt, rows):
+    pytest.importorskip({"csv": "pandas", "parquet": "pyarrow", "xlsx": "openpyxl"}[fmt])
+    out = io.BytesIO()
+    assert write_export(frame_chunks(priced_frame(rows), chunk_rows=4), out, fmt) == rows
+    exported = read_back(out.getvalue(), fmt)
+    assert exported.columns.tolist() == [col for col in priced_frame(0).columns if col not in EXPORT_DROP_COLUMNS]
+    assert exported["Part Number"].tolist() == [f"P{i}" for i in range(rows)]
+
+def test_parquet_without_chunks_is_readable(tmp_path):
+    pytest.importorskip("pyarrow")
+    path, rows_written = export_to_tempfile([], "parquet", "zstd", directory=tmp_path)
+    assert rows_written == 0
+    assert pd.read_parquet(path).empty
@@ -0,0 +1,81 @@
+import io
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from calculations import calculate_pricing, landed_cost_arrays
+from database_setup import get_initial_category_multipliers, get_initial_markup_data
+from freight import (DEFAULT_FREIGHT, FREIGHT_STRATEGIES, FreightStrategy, bind_freight, freight_from_spec, freight_spec,
+                     freight_strategy)
+from streaming import price_chunks
+
+STRATEGIES = [
+    freight_strategy("value"),
+    freight_strategy("weight"),
+    freight_strategy("weight", column="Kg", total_weight=1234.5),
+    freight_strategy("per_line", amount=12.5),
+    freight_strategy("percentage", pct=3.0),
+    freight_strategy("category", rates={"Universal": 4.0, "N/A": 1.0}, default_pct=2.0),
+]
+
+@pytest.mark.parametrize("freight", STRATEGIES, ids=lambda freight: freight.name)
+def test_spec_round_trip(freight):
+    restored = freight_from_spec(freight_spec(freight))
+    assert restored == freight
+    assert hash(restored) == hash(freight)
+
+def test_default_has_no_spec():
+    assert freight_spec(None) is None
+    assert freight_spec(DEFAULT_FREIGHT) is None
+    assert freight_from_spec(None) == DEFAULT_FREIGHT
+
+def test_registry_covers_every_strategy():
+    assert {freight.name for freight in STRATEGIES} == set(FREIGHT_STRATEGIES)
+
+def test_kinds_with_equal_parameters_differ():
+    assert freight_strategy("per_line", amount=5.0) != freight_strategy("percentage", pct=5.0)
+
+def test_strategy_must_implement_freight_per_unit():
+    class Incomplete(FreightStrategy, tuple):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(TypeError):
+        freight_spec({"name": "value"})
+
+def test_per_line_skips_zero_quantity_lines():
+    qty = np.array([0.0, 2.0, 4.0])
+    cost = np.array([10.0, 10.0, 10.0])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        _, landed = landed_cost_arrays(qty, cost, 60.0, 0.0, "AUD", 1.0, freight=freight_strategy("per_line", amount=8.0))
+    assert landed.tolist() == [10.0, 14.0, 12.0]
+
+def test_weight_is_bound_before_chunked_pricing():
+    rng = np.random.default_rng(5)
+    rows = 250
+    categories = get_initial_category_multipliers()
+    multipliers = dict(zip(categories["Category"], categories["Multiplier"]))
+    df = pd.DataFrame({
+        "Qty": rng.integers(1, 10, rows),
+        "Inv #": "INV",
+        "Part Number": [f"P{i}" for i in range(rows)],
+        "Purchase Cost": np.round(rng.uniform(1, 500, rows), 2),
+        "Category": rng.choice(categories["Category"], rows),
+        "Weight": np.round(rng.uniform(0.1, 30, rows), 2),
+    })
+    source = io.BytesIO(df.to_csv(index=False).encode())
+    source.name = "invoice.csv"
+    markup = get_initial_markup_data()
+
+    chunks = list(price_chunks(source, 500.0, "AUD", 1.0, markup, multipliers, chunk_size=60, freight=freight_strategy("weight")))
+    assert len(chunks) == 5
+    chunked = pd.concat(chunks, ignore_index=True)
+
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    bound = bind_freight(freight_strategy("weight"), df)
+    assert bound.total_weight == pytest.approx((df["Qty"] * df["Weight"]).sum())
+    whole = calculate_pricing(df.copy(), total_purchase, 500.0, "AUD", 1.0, markup, multipliers, freight=bound)
+    np.testing.assert_allclose(chunked["Landed Cost AUD"], whole["Landed Cost AUD"])
+    np.testing.assert_array_equal(chunked["RRPP"], whole["RRPP"])
@@ -0,0 +1,45 @@
+import io
+import pandas as pd
+import pytest
+from ingestion import clean_purchase_frame, load_purchase_file
+from streaming import read_purchase_chunks
+
+# "N/A" and "NA" are real categories; only an empty cell takes the default category
+ROWS = pd.DataFrame({
+    "Qty": ["2", "1", "3"],
+    "Inv #": ["INV", "INV", "INV"],
+    "Part Number": ["007", "P2", "P3"],
+    "Purchase Cost": ["10.50", "4", "7"],
+    "Category": ["N/A", "NA", ""],
+})
+EXPECTED_CATEGORIES = ["N/A", "NA", "Default"]
+
+def purchase_file(suffix):
+    buffer = io.BytesIO()
+    if suffix == ".csv":
+        ROWS.to_csv(buffer, index=False)
+    else:
+        pytest.importorskip("openpyxl")
+        ROWS.to_excel(buffer, index=False)
+    buffer.name = f"invoice{suffix}"
+    buffer.seek(0)
+    return buffer
+
+@pytest.mark.parametrize("suffix", [".csv", ".xlsx"])
+def test_load_purchase_file_keeps_na_categories(suffix):
+    df = load_purchase_file(purchase_file(suffix), default_category="Default")
+    assert list(df["Category"]) == EXPECTED_CATEGORIES
+    assert list(df["Part Number"]) == ["007", "P2", "P3"]
+
+@pytest.mark.parametrize("suffix", [".csv", ".xlsx"])
+def test_compact_load_keeps_na_categories(suffix):
+    df = load_purchase_file(purchase_file(suffix), default_category="Default", categories=["N/A", "NA"])
+    assert list(df["Category"].astype(str)) == EXPECTED_CATEGORIES
+
+@pytest.mark.parametrize("suffix", [".csv", ".xlsx"])
+def test_streaming_matches_page_load(suffix):
+    chunks = read_purchase_chunks(purchase_file(suffix), chunk_size=2)
+    streamed = pd.concat([clean_purchase_frame(chunk, "Default") for chunk in chunks], ignore_index=True)
+    loaded = load_purchase_file(purchase_file(suffix), default_category="Default")
+    assert list(streamed["Category"]) == EXPECTED_CATEGORIES
+    pd.testing.assert_series_equal(streamed["Category"], loaded["Category"])
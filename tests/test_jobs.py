@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+import jobs
+from calculations import calculate_pricing
+from jobs import collect_job_result, job_status, run_next_chunk, submit_job, worker_loop
+from rules import get_pricing_rules
+from storage import connect
+
+pytest.importorskip("pyarrow")
+
+def invoice(rows=30):
+    return pd.DataFrame({
+        "Qty": [i % 4 for i in range(rows)],
+        "Inv #": "INV",
+        "Part Number": [f"P{i}" for i in range(rows)],
+        "Purchase Cost": [float(i * 37 % 900) + 0.5 for i in range(rows)],
+        "Category": ["Universal", "Speciality"] * (rows // 2),
+    })
+
+def test_idle_poll_does_not_take_the_write_lock(rules_db):
+    writer, conn = connect(rules_db), connect(rules_db)
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        conn.execute("PRAGMA busy_timeout = 100")
+        # Would raise "database is locked" if an empty queue were polled with an UPDATE
+        assert not run_next_chunk(conn)
+        assert not conn.in_transaction
+    finally:
+        writer.rollback()
+        writer.close()
+        conn.close()
+
+def test_worker_exits_when_idle(rules_db):
+    # Returns instead of polling forever
+    worker_loop(rules_db, idle_seconds=0)
+
+def test_job_matches_foreground_pricing(rules_db, monkeypatch):
+    monkeypatch.setattr(jobs, "MIN_JOB_CHUNK_ROWS", 1)
+    df = invoice()
+    job_id = submit_job(df, 120.0, "USD", 0.65, db_path=rules_db, workers=1, chunk_rows=10)
+    assert job_status(job_id, rules_db)["chunk_count"] == 3
+    worker_loop(rules_db, idle_seconds=0)
+    assert job_status(job_id, rules_db)["status"] == "done"
+
+    rules = get_pricing_rules(rules_db)
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    expected = calculate_pricing(df.copy(), total_purchase, 120.0, "USD", 0.65, rules.markup_index, rules.category_multipliers, compact=True)
+    pd.testing.assert_frame_equal(collect_job_result(job_id, rules_db), expected, check_dtype=False)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from markup_index import DEFAULT_MARKUP, MarkupIndex
+
+# Bands [0, 10] and [20, 30] with a gap between them
+LOWER, UPPER, MARKUPS = [0.0, 20.0], [10.0, 30.0], [2.0, 1.5]
+
+def index(on_gap):
+    return MarkupIndex(LOWER, UPPER, MARKUPS, on_gap=on_gap)
+
+def test_costs_inside_bands_match_for_every_policy():
+    costs = [0.0, 5.0, 10.0, 20.0, 25.0, 30.0]
+    for on_gap in ("lower", "nearest", "flag"):
+        assert index(on_gap).lookup(costs).tolist() == [2.0, 2.0, 2.0, 1.5, 1.5, 1.5]
+
+def test_lower_uses_band_below_gap():
+    markup = index("lower")
+    assert markup.resolved_codes([10.5, 15.0, 19.99]).tolist() == [0, 0, 0]
+    assert markup.lookup([19.99]).tolist() == [2.0]
+
+def test_nearest_uses_closest_band_and_lower_on_ties():
+    markup = index("nearest")
+    assert markup.resolved_codes([11.0, 15.0, 19.0]).tolist() == [0, 0, 1]
+    assert markup.lookup([19.0]).tolist() == [1.5]
+
+def test_flag_leaves_gap_unmatched():
+    markup = index("flag")
+    assert markup.resolved_codes([15.0]).tolist() == [-1]
+    assert markup.lookup([15.0]).tolist() == [DEFAULT_MARKUP]
+
+@pytest.mark.parametrize("on_gap", ["lower", "nearest", "flag"])
+def test_costs_outside_table_are_not_gaps(on_gap):
+    costs = [-1.0, 31.0, np.nan]
+    markup = index(on_gap)
+    assert not markup.gap_mask(costs).any()
+    assert markup.resolved_codes(costs).tolist() == [-1, -1, -1]
+    assert markup.lookup(costs).tolist() == [DEFAULT_MARKUP] * 3
+
+def test_first_band_in_table_order_wins_overlaps():
+    # The second band lies inside the first; the third starts lower but comes later
+    markup = MarkupIndex([5.0, 6.0, 0.0], [10.0, 8.0, 7.0], [1.0, 2.0, 3.0])
+    assert markup.has_overlaps
+    assert markup.band_codes([0.0, 4.0, 5.0, 6.5, 7.0, 8.0, 9.0]).tolist() == [2, 2, 0, 0, 0, 0, 0]
+
+def test_has_overlaps():
+    assert not index("lower").has_overlaps
+    # Bands that only share an edge overlap at that cost
+    assert MarkupIndex([0.0, 10.0], [10.0, 20.0], [1.0, 2.0]).has_overlaps
+    assert not MarkupIndex([0.0, 2.5], [2.49, 4.99], [1.0, 2.0]).has_overlaps
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from calculations import calculate_pricing
+from database_setup import get_initial_category_multipliers, get_initial_markup_data
+from freight import freight_spec, freight_strategy
+from rule_store import reprice_run, rules_as_of, save_category_multipliers, save_markup_table
+from rules import get_rules_version
+from storage import connect, save_priced_parts
+
+PRICE_COLUMNS = ["Landed Cost AUD", "RRPP Markup", "Category Multiplier", "RRPP", "Tier 1", "Tier 2", "Tier 3", "Tier 4", "Tier 5"]
+# After the fixture loads the default rules
+START = datetime.now() + timedelta(days=1)
+
+@pytest.fixture
+def conn(rules_db):
+    conn = connect(rules_db)
+    yield conn
+    conn.close()
+
+def invoice(rows=300):
+    rng = np.random.default_rng(7)
+    categories = get_initial_category_multipliers()["Category"]
+    return pd.DataFrame({
+        "Qty": rng.integers(1, 10, rows),
+        "Inv #": "INV",
+        "Part Number": [f"P{i}" for i in range(rows)],
+        "Purchase Cost": np.round(rng.uniform(0, 400, rows), 2),
+        "Category": rng.choice(categories, rows),
+    })
+
+def change_rules(conn, timestamp):
+    # Drops two bands (leaving a gap) and the first category, and changes one multiplier
+    markup = get_initial_markup_data()
+    save_markup_table(conn, markup.drop(index=[3, 4]), "individual_change", timestamp)
+    multipliers = get_initial_category_multipliers().iloc[1:].copy()
+    multipliers.iloc[0, multipliers.columns.get_loc("Multiplier")] += 0.5
+    save_category_multipliers(conn, multipliers, "individual_change", timestamp)
+
+def save_run(conn, df, rules_version, freight=None, timestamp=START):
+    markup, multipliers = rules_as_of(conn, version=rules_version)
+    total_purchase = (df["Qty"] * df["Purchase Cost"]).sum()
+    priced = calculate_pricing(df.copy(), total_purchase, 250.0, "USD", 0.65, markup, multipliers, freight=freight)
+    run_id = save_priced_parts(conn, priced, timestamp=timestamp, currency="USD", exchange_rate=0.65, freight_cost=250.0,
+                               rules_version=rules_version, freight_allocation=freight_spec(freight))
+    return priced, run_id
+
+def assert_same_prices(expected, actual):
+    pd.testing.assert_frame_equal(actual[PRICE_COLUMNS].reset_index(drop=True), expected[PRICE_COLUMNS].reset_index(drop=True),
+                                  check_dtype=False)
+
+def test_rules_as_of_after_removals_and_changes(conn):
+    initial_version = get_rules_version(conn)
+    change_rules(conn, START + timedelta(days=1))
+
+    markup, multipliers = rules_as_of(conn, version=initial_version)
+    pd.testing.assert_frame_equal(markup, get_initial_markup_data(), check_dtype=False)
+    initial = get_initial_category_multipliers()
+    assert multipliers == dict(zip(initial["Category"], initial["Multiplier"]))
+
+    markup, multipliers = rules_as_of(conn)
+    assert len(markup) == len(get_initial_markup_data()) - 2
+    assert initial["Category"].iloc[0] not in multipliers
+    assert multipliers[initial["Category"].iloc[1]] == initial["Multiplier"].iloc[1] + 0.5
+
+    # A timestamp maps to the version in force at that time
+    pd.testing.assert_frame_equal(rules_as_of(conn, timestamp=START + timedelta(hours=12))[0], get_initial_markup_data(),
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(rules_as_of(conn, timestamp=START + timedelta(days=2))[0], markup)
+
+@pytest.mark.parametrize("freight", [None, freight_strategy("category", rates=(("Universal", 5.0), ("Local", 2.5)), default_pct=1.0)])
+def test_reprice_run_uses_the_rules_it_was_priced_with(conn, freight):
+    df = invoice()
+    priced, run_id = save_run(conn, df, get_rules_version(conn), freight)
+    change_rules(conn, START + timedelta(days=1))
+    assert_same_prices(priced, reprice_run(conn, run_id))
+
+    # A run priced under the changed rules reprices with those
+    changed, changed_run = save_run(conn, df, get_rules_version(conn), freight, START + timedelta(days=2))
+    assert not np.array_equal(changed["RRPP"], priced["RRPP"])
+    assert_same_prices(changed, reprice_run(conn, changed_run))
+
+def test_reprice_run_without_a_version_uses_its_timestamp(conn):
+    df = invoice(50)
+    priced, run_id = save_run(conn, df, get_rules_version(conn), timestamp=START + timedelta(hours=12))
+    conn.execute('UPDATE pricing_runs SET "rules_version" = NULL WHERE "run_id" = ?', (run_id,))
+    conn.commit()
+    change_rules(conn, START + timedelta(days=1))
+    assert_same_prices(priced, reprice_run(conn, run_id))